@@ -0,0 +1,166 @@
+import argparse
+import bundle
+import json
+import metrics
+import numpy as np
+import pandas as pd
+import pathlib as pth
+import typing as typ
+
+
+class Args(typ.TypedDict):
+    datadir: str
+    fractions: bool
+    keys: str
+    names: str
+    output: str
+
+
+class Table(typ.TypedDict):
+    keys: list[str]
+    rows: list[list[typ.Any]]
+
+
+# Primary order of printable ascii under js localeCompare, case aside.
+collation = " _-,;:!?.'\"()[]{}@*/\\&#%`^+<=>|~$0123456789abcdefghijklmnopqrstuvwxyz"
+
+# Metric keys for the site, in the order merge.ts sums them, by file stem.
+file_stems = {
+    "issues": "gh-issue-event",
+    "pulls": "gh-pull-request",
+    "stars": "gh-star-event",
+    "soQuestions": "so-tags",
+}
+
+
+def assemble(
+    counts: dict[str, pd.DataFrame],
+    *,
+    canonical_names: dict[str, str],
+    fractions: bool,
+    translations: Table,
+) -> dict[str, typ.Any]:
+    """Encodes counts by metric key into the bundle the site loads.
+
+    Counts need name, year, quarter, and count, as written by gh_to_json and
+    so_process. Canonical names map old or split names onto what the site
+    shows, with counts for the same result summed. Fractions adds a shares
+    table of percents of each quarter's sum, as the site would normalize to.
+    """
+    renamed = {
+        key: frame.assign(
+            name=frame["name"].map(lambda name: canonical_names.get(name, name))
+        )
+        for key, frame in counts.items()
+    }
+    result: dict[str, typ.Any] = {
+        **bundle.encode(renamed),
+        "translations": translations,
+    }
+    if fractions:
+        result["shares"] = shares(renamed)
+    return result
+
+
+def collation_key(text: str) -> tuple[tuple[int, ...], tuple[bool, ...]]:
+    """Sorts like js localeCompare: by letters first, then lower before upper."""
+    primary = tuple(
+        collation.find(char.lower()) if char.isascii() else ord(char) for char in text
+    )
+    return primary, tuple(char.isupper() for char in text)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--datadir", default="../scripts/data")
+    parser.add_argument("--fractions", action="store_true")
+    parser.add_argument("--keys", default="../scripts/data/keys.csv")
+    parser.add_argument(
+        "--names",
+        default="../scripts/data/canonical-names.json",
+        help="renames shared with merge.ts",
+    )
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args().__dict__
+    run(args=args)
+
+
+def read_counts(datadir: str) -> dict[str, pd.DataFrame]:
+    dir = pth.Path(datadir)
+    return {key: pd.read_json(dir / f"{stem}.json") for key, stem in file_stems.items()}
+
+
+def read_translations(name: str) -> Table:
+    keys = pd.read_csv(name, dtype=str, keep_default_na=False)
+    return {"keys": list(keys.columns), "rows": keys.to_numpy().tolist()}
+
+
+def run(*, args: Args):
+    with metrics.stage("read") as info:
+        counts = read_counts(args["datadir"])
+        info.count("rows", sum(len(frame) for frame in counts.values()))
+        canonical_names = json.loads(pth.Path(args["names"]).read_text())
+    with metrics.stage("assemble"):
+        site = assemble(
+            counts,
+            canonical_names=canonical_names,
+            fractions=args["fractions"],
+            translations=read_translations(args["keys"]),
+        )
+    metrics.count("names", len(site["names"]))
+    with open(args["output"], "w") as output:
+        json.dump(site, output, ensure_ascii=False, separators=(",", ":"))
+        output.write("\n")
+
+
+def shares(counts: dict[str, pd.DataFrame]) -> Table:
+    """Gives each metric's percent of its quarter's sum, in merge.ts order."""
+    outs = list(file_stems)
+    parts = [
+        frame[["name", "year", "quarter", "count"]].assign(metric=key)
+        for key, frame in counts.items()
+    ]
+    joined = pd.concat(parts, ignore_index=True)
+    joined["date"] = (
+        joined["year"].astype(str) + "Q" + joined["quarter"].astype(str)
+    ).astype(object)
+    # One pivot does the outer join, with repeats after renames summed.
+    items = joined.pivot_table(
+        aggfunc="sum",
+        columns="metric",
+        fill_value=0,
+        index=["name", "date"],
+        values="count",
+    )
+    items = items.reindex(columns=outs, fill_value=0).astype(np.int64)
+    items.columns.name = None
+    items.reset_index(inplace=True)
+    names = sorted(items["name"].unique(), key=collation_key)
+    name_ranks = pd.Series(np.arange(len(names)), index=names)
+    items.sort_values(
+        by=["name", "date"],
+        ignore_index=True,
+        inplace=True,
+        key=lambda column: column.map(name_ranks) if column.name == "name" else column,
+    )
+    # Merge.ts gives metrics after its keys in sorted order.
+    items = items[["name", "date", *sorted(outs)]]
+    sums = items.groupby("date")[outs].sum()
+    totals = sums.loc[items["date"], outs].to_numpy()
+    # Quarters with nothing for a metric give shares of 0 there.
+    values = np.divide(
+        100 * items[outs].to_numpy(),
+        totals,
+        out=np.zeros(totals.shape),
+        where=totals != 0,
+    )
+    result = items[["name", "date"]].assign(**dict(zip(outs, values.T)))
+    return table(result[items.columns])
+
+
+def table(frame: pd.DataFrame) -> Table:
+    return {"keys": list(frame.columns), "rows": frame.astype(object).values.tolist()}
+
+
+if __name__ == "__main__":
+    metrics.run(main)
@@ -0,0 +1,443 @@
+import argparse
+import collections
+import ghindex
+import gzip
+import ghstore
+import json
+import numpy as np
+import pandas as pd
+import pathlib as pth
+import platform
+import process
+import subprocess
+import sys
+import tempfile
+import time
+import typing as typ
+
+Stage = typ.Literal[
+    "gharchive",
+    "ghmerge",
+    "langmerge",
+    "gh_merge_events",
+    "gh_to_json",
+    "so_process",
+    "process",
+    "process_impls",
+]
+# In pipeline order, since later stages read earlier outputs.
+stages: list[Stage] = list(typ.get_args(Stage))
+events = ["IssuesEvent", "PullRequestEvent", "WatchEvent"]
+here = pth.Path(__file__).parent
+
+
+class Args(typ.TypedDict):
+    compare: str | None
+    keep: str | None
+    keys: str | None
+    langs: int
+    report: str | None
+    rows: int
+    seed: int
+    stages: list[Stage] | None
+    workers: int | None
+
+
+class Result(typ.TypedDict):
+    impl: str
+    # Of the stage's own process, not any pool workers.
+    peak_rss_mb: float | None
+    rows: int
+    rows_per_second: float
+    seconds: float
+    stage: str
+
+
+def bench_process(*, keys_name: str, so_name: str, rows: int) -> list[Result]:
+    """Compares the old ComboKey aggregation with count_combos."""
+
+    def old():
+        counts: dict[process.ComboKey, int] = collections.defaultdict(int)
+        for combo, count in process.combos_iter(keys_name=keys_name, so_name=so_name):
+            counts[combo] += count
+        return counts
+
+    def new():
+        return process.count_combos(keys_name=keys_name, so_name=so_name)
+
+    old_counts, old_result = timed(
+        old, impl="combos_iter", rows=rows, stage="process_impls"
+    )
+    new_counts, new_result = timed(
+        new, impl="count_combos", rows=rows, stage="process_impls"
+    )
+    names = sorted(set(process.read_keys(keys_name).values()))
+    unpacked = {}
+    for combo, count in new_counts.items():
+        name, year, quarter = process.unpack_combo(combo)
+        unpacked[process.ComboKey(name=names[name], year=year, quarter=quarter)] = count
+    assert unpacked == old_counts, "implementations disagree"
+    return [old_result, new_result]
+
+
+def compare(results: list[Result], name: str):
+    """Prints how each stage's time and memory moved against an old report."""
+    old = {
+        (result["stage"], result["impl"]): result
+        for result in json.loads(pth.Path(name).read_text())["results"]
+    }
+    for result in results:
+        before = old.get((result["stage"], result["impl"]))
+        if before is None:
+            continue
+        change = {
+            "impl": result["impl"],
+            "seconds_ratio": result["seconds"] / before["seconds"],
+            "stage": result["stage"],
+        }
+        if result["peak_rss_mb"] and before["peak_rss_mb"]:
+            change["rss_ratio"] = result["peak_rss_mb"] / before["peak_rss_mb"]
+        print(json.dumps(change))
+
+
+def git_commit() -> str | None:
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, check=True, cwd=here
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.decode().strip()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--compare", help="earlier report to compare against")
+    parser.add_argument("--keep", help="dir to keep generated data and outputs in")
+    parser.add_argument("--keys", help="keys.csv to use instead of synthetic keys")
+    parser.add_argument("--langs", default=200, type=int)
+    parser.add_argument("--report", help="json file for results and metadata")
+    parser.add_argument("--rows", default=1_000_000, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--stages", choices=stages, nargs="+")
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args().__dict__
+    run(args=args)
+
+
+def repo_names(count: int) -> np.ndarray:
+    # Some owners have many repos, as in the real thing.
+    owners = max(1, count // 4)
+    return np.array([f"owner{index % owners}/repo{index}" for index in range(count)])
+
+
+def run(*, args: Args):
+    if args["keep"]:
+        pth.Path(args["keep"]).mkdir(exist_ok=True, parents=True)
+        results = run_in(pth.Path(args["keep"]), args=args)
+    else:
+        with tempfile.TemporaryDirectory() as dir:
+            results = run_in(pth.Path(dir), args=args)
+    for result in results:
+        print(json.dumps(result))
+    if args["report"]:
+        report = {
+            "args": args,
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "results": results,
+        }
+        pth.Path(args["report"]).write_text(json.dumps(report, indent=2))
+    if args["compare"]:
+        compare(results, args["compare"])
+
+
+def run_in(dir: pth.Path, *, args: Args) -> list[Result]:
+    chosen = args["stages"] or [stage for stage in stages if stage != "process_impls"]
+    rows = args["rows"]
+    # Around ten event rows per repo, for plenty of repeats to sum.
+    repos = max(1, rows // 10)
+    keys_name = args["keys"]
+    if keys_name is None:
+        keys_name = str(dir / "keys.csv")
+        write_keys(keys_name, langs=args["langs"])
+    archive_dir = dir / "archive"
+    events_name = str(dir / "events.csv")
+    so_name = str(dir / "so.csv")
+    chunks_dir = dir / "chunks"
+    outdir = dir / "out"
+    outdir.mkdir(exist_ok=True)
+    work = {
+        "archive_events": str(dir / "archive-events.csv"),
+        "gh_events": str(dir / "gh-events.csv"),
+        "gh_langs": str(dir / "gh-langs.csv"),
+        "langs": str(dir / "langs.csv"),
+    }
+    seed = args["seed"]
+    if "gharchive" in chosen:
+        write_archive(archive_dir, repos=repos, rows=rows, seed=seed)
+    if {"ghmerge", "langmerge", "gh_merge_events"} & set(chosen):
+        write_chunks(chunks_dir, langs=args["langs"], repos=repos, seed=seed)
+    if {"gh_merge_events", "gh_to_json"} & set(chosen):
+        write_events(events_name, repos=repos, rows=rows, seed=seed)
+    if {"so_process", "process", "process_impls"} & set(chosen):
+        write_so(so_name, keys_name=keys_name, rows=rows, seed=seed)
+    workers = [] if not args["workers"] else ["--workers", str(args["workers"])]
+    commands: dict[Stage, tuple[list[str], int]] = {
+        "gharchive": (
+            ["gharchive.py", "--inputs", str(archive_dir / "*.json.gz")]
+            + ["--output", work["archive_events"]]
+            + workers,
+            rows,
+        ),
+        "ghmerge": (
+            ["ghmerge.py", "--jsondir", str(chunks_dir), "--output", work["gh_langs"]]
+            + workers,
+            repos,
+        ),
+        "langmerge": (
+            ["langmerge.py", "--inputs", work["gh_langs"]]
+            + ["--drops", "empty", "multi", "--output", work["langs"]],
+            repos,
+        ),
+        "gh_merge_events": (
+            ["gh_merge_events.py", "--events", events_name]
+            + ["--langs", work["langs"], "--output", work["gh_events"]]
+            + workers,
+            rows,
+        ),
+        "gh_to_json": (
+            ["gh_to_json.py", "--csv", work["gh_events"], "--outdir", str(outdir)],
+            rows,
+        ),
+        "so_process": (
+            ["so_process.py", "--keys", keys_name, "--outdir", str(outdir)]
+            + ["--so", so_name]
+            + workers,
+            rows,
+        ),
+        "process": (
+            ["process.py", "--keys", keys_name, "--so", so_name]
+            + ["--jobs", str(args["workers"] or 1)],
+            rows,
+        ),
+    }
+    # Outputs from earlier kept runs would trip the exists checks.
+    outputs = {
+        "gharchive": work["archive_events"],
+        "gh_merge_events": work["gh_events"],
+        "ghmerge": work["gh_langs"],
+        "langmerge": work["langs"],
+    }
+    for stage in chosen:
+        if stage in outputs:
+            pth.Path(outputs[stage]).unlink(missing_ok=True)
+    results: list[Result] = []
+    for stage in chosen:
+        if stage == "process_impls":
+            results += bench_process(keys_name=keys_name, so_name=so_name, rows=rows)
+            continue
+        command, stage_rows = commands[stage]
+        if stage == "ghmerge":
+            # Make it scan every chunk, not just reuse its index.
+            (chunks_dir / ghindex.file_name).unlink(missing_ok=True)
+        results.append(run_stage(command, rows=stage_rows, stage=stage))
+    return results
+
+
+def run_stage(command: list[str], *, rows: int, stage: str) -> Result:
+    """Runs a script as its own process to measure its time and peak memory."""
+    with tempfile.TemporaryDirectory() as dir:
+        rss_name = str(pth.Path(dir) / "rss")
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", runner, rss_name, str(here / command[0])]
+            + command[1:],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        seconds = time.perf_counter() - start
+        peak_rss_mb = float(pth.Path(rss_name).read_text())
+    return {
+        "impl": "script",
+        "peak_rss_mb": peak_rss_mb,
+        "rows": rows,
+        "rows_per_second": rows / seconds,
+        "seconds": seconds,
+        "stage": stage,
+    }
+
+
+# Runs a script as main, then records its peak memory. Linux counts the
+# parent's memory from before exec in ru_maxrss, so prefer VmHWM there.
+runner = """
+import pathlib, resource, runpy, sys
+
+rss_name, script = sys.argv[1:3]
+sys.argv = sys.argv[2:]
+sys.path.insert(0, str(pathlib.Path(script).parent))
+runpy.run_path(script, run_name="__main__")
+status = pathlib.Path("/proc/self/status")
+if status.exists():
+    line = [line for line in status.read_text().splitlines() if "VmHWM" in line][0]
+    peak = int(line.split()[1]) / 1024
+else:
+    # Bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1 << 20)
+pathlib.Path(rss_name).write_text(str(peak))
+"""
+
+
+def timed(
+    fun: typ.Callable[[], typ.Any], *, impl: str, rows: int, stage: str
+) -> tuple[typ.Any, Result]:
+    start = time.perf_counter()
+    value = fun()
+    seconds = time.perf_counter() - start
+    result: Result = {
+        "impl": impl,
+        "peak_rss_mb": None,
+        "rows": rows,
+        "rows_per_second": rows / seconds,
+        "seconds": seconds,
+        "stage": stage,
+    }
+    return value, result
+
+
+def write_archive(dir: pth.Path, *, repos: int, rows: int, seed: int):
+    """Writes hourly GH Archive files for a month, with other event types mixed in."""
+    rng = np.random.default_rng(seed)
+    names = repo_names(repos)
+    types = np.array(events + ["CreateEvent", "PushEvent"])
+    dir.mkdir(exist_ok=True, parents=True)
+    hour_rows = 100_000
+    for number, start in enumerate(range(0, rows, hour_rows)):
+        size = min(hour_rows, rows - start)
+        day, hour = divmod(number % (30 * 24), 24)
+        created_at = f"2025-07-{day + 1:02}T{hour:02}:30:00Z"
+        picks = types[rng.integers(0, len(types), size)]
+        repo_picks = names[(rng.zipf(1.3, size) - 1) % repos]
+        with gzip.open(
+            dir / f"2025-07-{day + 1:02}-{hour}-{number}.json.gz", "wt"
+        ) as out:
+            for index, (type, repo) in enumerate(zip(picks, repo_picks)):
+                record = {
+                    "id": str(start + index),
+                    "type": type,
+                    "actor": {"id": index, "login": f"user{index}"},
+                    "repo": {
+                        "id": index,
+                        "name": repo,
+                        "url": f"https://api.github.com/repos/{repo}",
+                    },
+                    "payload": {"action": "started"},
+                    "public": True,
+                    "created_at": created_at,
+                }
+                out.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+
+def write_chunks(dir: pth.Path, *, langs: int, repos: int, seed: int):
+    """Writes GraphQL responses for every repo as a ghquery segment store."""
+    rng = np.random.default_rng(seed)
+    names = repo_names(repos)
+    # Popular langs dominate, and some repos are gone or have no lang.
+    lang_picks = rng.zipf(1.5, size=repos) % langs
+    missing = rng.random(repos) < 0.05
+    no_lang = rng.random(repos) < 0.1
+    forks = rng.random(repos) < 0.2
+    store = ghstore.ChunkStore(dir)
+    try:
+        for number, start in enumerate(range(0, repos, 100)):
+            data: dict[str, typ.Any] = {}
+            for index in range(start, min(start + 100, repos)):
+                key = f"r{index - start}"
+                if missing[index]:
+                    data[key] = None
+                    continue
+                lang = None if no_lang[index] else {"name": f"Lang{lang_picks[index]}"}
+                data[key] = {
+                    "isFork": bool(forks[index]),
+                    "nameWithOwner": names[index],
+                    "primaryLanguage": lang,
+                }
+            name = f"chunk{number}.json"
+            if name not in store:
+                store.add(name, {"data": data})
+    finally:
+        store.close()
+
+
+def write_events(name: str, *, repos: int, rows: int, seed: int):
+    """Writes a BigQuery-shaped GitHub events dump, a batch at a time."""
+    rng = np.random.default_rng(seed)
+    names = repo_names(repos)
+    batch_rows = 1_000_000
+    with open(name, "w", newline="") as out:
+        for start in range(0, rows, batch_rows):
+            size = min(batch_rows, rows - start)
+            frame = pd.DataFrame(
+                {
+                    "year": rng.integers(2011, 2026, size),
+                    "quarter": rng.integers(1, 5, size),
+                    # Already past the having count >= 10 in the query.
+                    "count": 10 + np.minimum(rng.pareto(1.2, size), 1e6).astype(int),
+                    "event": np.array(events)[rng.integers(0, len(events), size)],
+                    "repo": names[(rng.zipf(1.3, size) - 1) % repos],
+                }
+            )
+            frame.to_csv(out, header=start == 0, index=False)
+
+
+def write_keys(name: str, *, langs: int):
+    """Writes keys for synthetic langs, each with a few Stack Overflow tags."""
+    keys = pd.DataFrame(
+        {
+            "key": [f"Lang{index}" for index in range(langs)],
+            "wikipedia": [
+                f"Lang{index} (programming language)" for index in range(langs)
+            ],
+            "reddit": [f"lang{index}" for index in range(langs)],
+            "stackoverflow": [
+                "|".join(f"lang{index}-{tag}" for tag in range(1 + index % 3))
+                for index in range(langs)
+            ],
+        }
+    )
+    keys.to_csv(name, index=False)
+
+
+def write_so(name: str, *, keys_name: str, rows: int, seed: int):
+    """Writes a BigQuery-shaped Stack Overflow tag dump, a batch at a time."""
+    rng = np.random.default_rng(seed)
+    tags = sorted(process.read_keys(keys_name))
+    # Plenty of tags that map to nothing, as in the real dump.
+    tags += [f"tag{index}" for index in range(len(tags) * 20)]
+    tags = np.array(tags)
+    rng.shuffle(tags)
+    # Tag combos recur across quarters in the real thing.
+    combo_count = max(1, rows // 4)
+    sizes = rng.integers(1, 6, combo_count)
+    picks = (rng.zipf(1.3, sizes.sum()) - 1) % len(tags)
+    ends = np.cumsum(sizes)
+    combos = np.array(
+        ["|".join(tags[picks[end - size : end]]) for size, end in zip(sizes, ends)]
+    )
+    batch_rows = 1_000_000
+    with open(name, "w", newline="") as out:
+        for start in range(0, rows, batch_rows):
+            size = min(batch_rows, rows - start)
+            frame = pd.DataFrame(
+                {
+                    "count": 1 + np.minimum(rng.pareto(1.2, size), 1e6).astype(int),
+                    "tags": combos[rng.integers(0, combo_count, size)],
+                    "year": rng.integers(2008, 2026, size),
+                    "quarter": rng.integers(1, 5, size),
+                }
+            )
+            frame.to_csv(out, header=start == 0, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import base64
+import langresolve
+import numpy as np
+import pandas as pd
+import typing as typ
+
+version = 1
+
+
+class Bundle(typ.TypedDict):
+    """Counts for every metric on one grid of names by quarters.
+
+    This is the form the site loads, decoded by src/parsedData.ts. Each
+    metric is a base64 string of varints, row by row for each name, of
+    zigzagged differences from the quarter before, since counts mostly move
+    a little at a time.
+    """
+
+    metrics: dict[str, str]
+    names: list[str]
+    # Year and quarter of the first column, with one column per quarter after.
+    start: list[int]
+    quarters: int
+    version: int
+
+
+def encode(metrics: dict[str, pd.DataFrame]) -> Bundle:
+    """Puts frames with name, year, quarter, and count onto one shared grid.
+
+    Merge.ts writes the same bytes from the same counts, so keep them in step.
+    """
+    frames = [frame for frame in metrics.values() if len(frame)]
+    names = sorted(set().union(*(set(frame["name"]) for frame in frames)))
+    times = [
+        langresolve.quarter_number(frame["year"], frame["quarter"]).to_numpy()
+        for frame in frames
+    ]
+    first = min((int(time.min()) for time in times), default=0)
+    last = max((int(time.max()) for time in times), default=-1)
+    index = pd.Index(names)
+    encoded = {}
+    for metric, frame in metrics.items():
+        grid = np.zeros((len(names), last - first + 1), dtype=np.int64)
+        time = langresolve.quarter_number(frame["year"], frame["quarter"]).to_numpy()
+        # Repeats get summed, as for names that renames bring together.
+        np.add.at(
+            grid,
+            (index.get_indexer(frame["name"]), time - first),
+            frame["count"].to_numpy(dtype=np.int64),
+        )
+        deltas = np.diff(grid, axis=1, prepend=0).ravel()
+        zigzags = (deltas << 1) ^ (deltas >> 63)
+        encoded[metric] = base64.b64encode(write_varints(zigzags)).decode()
+    return {
+        "metrics": encoded,
+        "names": names,
+        "quarters": last - first + 1,
+        "start": [first // 4, first % 4 + 1],
+        "version": version,
+    }
+
+
+def write_varints(values: np.ndarray) -> bytes:
+    output = bytearray()
+    for value in values.astype(np.uint64).tolist():
+        while value >= 0x80:
+            output.append(value & 0x7F | 0x80)
+            value >>= 7
+        output.append(value)
+    return bytes(output)
@@ -0,0 +1,139 @@
+import contextlib
+import glob
+import pandas as pd
+import pathlib as pth
+import typing as typ
+
+# Parquet and Arrow IPC go through pandas, so they need pyarrow installed.
+# CSV works without it.
+
+Format = typ.Literal["arrow", "csv", "parquet"]
+
+# Repetitive text columns worth dictionary encoding.
+category_columns = ["event", "lang", "name", "repo", "tags"]
+
+# Small integer columns that otherwise default to 64 bits.
+int_columns = {"quarter": "int8", "year": "int16"}
+
+# Frames written while remembering, for reading back without disk.
+# Only columnar formats, since csv would turn things like "" into missing.
+memo: dict[str, pd.DataFrame] | None = None
+
+suffix_formats: dict[str, Format] = {
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".ipc": "arrow",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+}
+
+
+def column_names(name: str | pth.Path) -> list[str]:
+    """Reads just the column names, without loading any rows."""
+    match format_of(name):
+        case "arrow":
+            import pyarrow.ipc
+
+            with pyarrow.ipc.open_file(name) as reader:
+                return reader.schema.names
+        case "parquet":
+            import pyarrow.parquet
+
+            return pyarrow.parquet.read_schema(name).names
+        case _:
+            return list(pd.read_csv(name, nrows=0).columns)
+
+
+def compact(frame: pd.DataFrame) -> pd.DataFrame:
+    """Gives columnar formats dictionary-encoded text and narrow ints."""
+    frame = frame.copy()
+    for column in category_columns:
+        if column in frame and frame[column].dtype != "category":
+            frame[column] = frame[column].astype("category")
+    for column, dtype in int_columns.items():
+        if column in frame and not frame[column].isnull().any():
+            frame[column] = frame[column].astype(dtype)
+    return frame
+
+
+def expand(names: typ.Iterable[str]) -> list[str]:
+    """Expands any globs, keeping order and leaving plain names alone."""
+    result = []
+    for name in names:
+        matches = sorted(glob.glob(name)) if glob.has_magic(name) else []
+        result += matches or [name]
+    return result
+
+
+def forget(name: str | pth.Path):
+    if memo is not None:
+        memo.pop(memo_key(name), None)
+
+
+def format_of(name: str | pth.Path) -> Format:
+    return suffix_formats.get(pth.Path(name).suffix.lower(), "csv")
+
+
+def iter_batches(
+    name: str | pth.Path, *, batch_rows: int, columns: list[str] | None = None
+) -> typ.Iterator[pd.DataFrame]:
+    """Reads a file a bounded number of rows at a time."""
+    match format_of(name):
+        case "arrow":
+            import pyarrow.ipc
+
+            with pyarrow.ipc.open_file(name) as reader:
+                for index in range(reader.num_record_batches):
+                    batch = reader.get_batch(index)
+                    if columns is not None:
+                        batch = batch.select(columns)
+                    yield batch.to_pandas()
+        case "parquet":
+            import pyarrow.parquet
+
+            file = pyarrow.parquet.ParquetFile(name)
+            for batch in file.iter_batches(batch_size=batch_rows, columns=columns):
+                yield batch.to_pandas()
+        case _:
+            yield from pd.read_csv(name, chunksize=batch_rows, usecols=columns)
+
+
+def memo_key(name: str | pth.Path) -> str:
+    return str(pth.Path(name).resolve())
+
+
+def read_frame(
+    name: str | pth.Path, *, columns: list[str] | None = None
+) -> pd.DataFrame:
+    if memo is not None and (frame := memo.get(memo_key(name))) is not None:
+        return (frame if columns is None else frame[columns]).copy()
+    match format_of(name):
+        case "arrow":
+            return pd.read_feather(name, columns=columns)
+        case "parquet":
+            return pd.read_parquet(name, columns=columns)
+        case _:
+            return pd.read_csv(name, usecols=columns)
+
+
+@contextlib.contextmanager
+def remembering() -> typ.Iterator[None]:
+    """Keeps written frames in memory, so later reads skip parsing files."""
+    global memo
+    memo = {}
+    try:
+        yield
+    finally:
+        memo = None
+
+
+def write_frame(frame: pd.DataFrame, name: str | pth.Path):
+    if memo is not None and format_of(name) != "csv":
+        memo[memo_key(name)] = frame.copy()
+    match format_of(name):
+        case "arrow":
+            compact(frame).reset_index(drop=True).to_feather(name)
+        case "parquet":
+            compact(frame).to_parquet(name, index=False)
+        case _:
+            frame.to_csv(name, index=False)
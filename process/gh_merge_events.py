@@ -1,38 +1,204 @@
 import argparse
+import concurrent.futures as cf
+import frames
+import ghindex
+import langresolve
+import metrics
+import multiprocessing
+import numpy as np
 import pandas as pd
+import partitions
 import pathlib as pth
+import repos
 import typing as typ
 
 
 class Args(typ.TypedDict):
-    events: str
+    batch_rows: int
+    cache: str | None
+    events: list[str]
     langs: str
     output: str
+    workers: int | None
+
+
+group_keys = ["year", "quarter", "event", "lang"]
+
+
+class LangLookup:
+    """Hashed repo index over the langs table for joining in batches.
+
+    Repos listed with several langs count toward each, as a merge would.
+    Repo names match after canonicalizing, so case and url forms don't matter.
+
+    Langs with year and quarter columns instead give when each lang took
+    effect, as from the ranged langresolve policy. Events then get the lang
+    as of their quarter, or the earliest known for quarters before that.
+    """
+
+    def __init__(self, langs: pd.DataFrame):
+        langs = langs.assign(repo=repos.normalize(langs["repo"]))
+        langs = langs[~langs["repo"].isnull()]
+        repo_codes, names = pd.factorize(langs["repo"])
+        lang_codes, self.names = pd.factorize(langs["lang"])
+        self.versioned = "year" in langs and "quarter" in langs
+        if self.versioned:
+            times = quarter_times(langs)
+            order = np.lexsort((times, repo_codes))
+            # One sorted key per change, for searching by repo and time.
+            self.keys = version_keys(repo_codes[order], times[order])
+        else:
+            order = np.argsort(repo_codes, kind="stable")
+        self.repos = pd.Index(np.asarray(names, dtype=object))
+        self.lang_codes = lang_codes[order]
+        self.lens = np.bincount(repo_codes, minlength=len(names))
+        self.starts = np.cumsum(self.lens) - self.lens
+        self.unique = not self.versioned and bool((self.lens == 1).all())
+
+    def join(self, events: pd.DataFrame) -> pd.DataFrame:
+        """Replaces repo with lang codes, dropping repos without one."""
+        repo_codes = self.repos.get_indexer(events["repo"])
+        misses = repo_codes < 0
+        if misses.any():
+            # Most names are canonical already, so only fix up the rest.
+            fixed = repos.normalize(events["repo"][misses]).astype(object)
+            repo_codes[misses] = self.repos.get_indexer(fixed)
+        events = events.drop(columns="repo")[repo_codes >= 0]
+        repo_codes = repo_codes[repo_codes >= 0]
+        if self.versioned:
+            keys = version_keys(repo_codes, quarter_times(events))
+            found = np.searchsorted(self.keys, keys, side="right") - 1
+            langs = self.lang_codes[np.maximum(found, self.starts[repo_codes])]
+        elif self.unique:
+            langs = self.lang_codes[self.starts[repo_codes]]
+        else:
+            lens = self.lens[repo_codes]
+            rows = np.repeat(np.arange(len(repo_codes)), lens)
+            offsets = np.arange(len(rows)) - np.repeat(np.cumsum(lens) - lens, lens)
+            langs = self.lang_codes[self.starts[repo_codes][rows] + offsets]
+            events = events.iloc[rows]
+        events = events.assign(lang=langs)
+        # Factorize gives missing langs -1, and merge results dropped them.
+        return events[events["lang"] >= 0]
+
+
+lookup: LangLookup | None = None
+
+
+def cache_key(name: str) -> str:
+    return f"gh_merge_events:{pth.Path(name).resolve()}"
+
+
+def fold(parts: list[pd.DataFrame]) -> pd.DataFrame:
+    return pd.concat(parts).groupby(level=group_keys, observed=True).sum()
+
+
+def init_worker(langs: LangLookup):
+    global lookup
+    lookup = langs
 
 
 def main():
     parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-rows", default=1_000_000, type=int)
+    parser.add_argument("--cache")
     parser.add_argument("--events", nargs="+", required=True)
     parser.add_argument("--langs", required=True)
     parser.add_argument("--output", required=True)
+    parser.add_argument("--workers", type=int)
     args = parser.parse_args().__dict__
     run(args=args)
 
 
+def merge_file(name: str, *, batch_rows: int) -> pd.DataFrame:
+    """Sums one events file by lang, reading a batch of rows at a time."""
+    assert lookup is not None
+    columns = ["year", "quarter", "event", "repo", "count"]
+    parts: list[pd.DataFrame] = []
+    for events in frames.iter_batches(name, batch_rows=batch_rows, columns=columns):
+        events = lookup.join(events)
+        parts.append(events.groupby(group_keys, observed=True)[["count"]].sum())
+        if len(parts) >= 16:
+            # Partial sums are small, but keep their count small too.
+            parts = [fold(parts)]
+    return fold(parts)
+
+
+def merge_files(names: list[str], *, args: Args) -> list[pd.DataFrame]:
+    """Sums each events file by lang name, with lookup already set up."""
+    assert lookup is not None
+    batch_rows = args["batch_rows"]
+    if args["workers"]:
+        # Pipeline stages start pools from threads, where forks can deadlock.
+        with cf.ProcessPoolExecutor(
+            initargs=(lookup,),
+            initializer=init_worker,
+            max_workers=args["workers"],
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            parts = [
+                executor.submit(merge_file, name, batch_rows=batch_rows)
+                for name in names
+            ]
+            parts = [part.result() for part in parts]
+    else:
+        parts = [merge_file(name, batch_rows=batch_rows) for name in names]
+    for part in parts:
+        part.reset_index(inplace=True)
+        part["lang"] = lookup.names[part["lang"]]
+    return parts
+
+
+def quarter_times(frame: pd.DataFrame) -> np.ndarray:
+    year = frame["year"].to_numpy(dtype=np.int64)
+    return langresolve.quarter_number(year, frame["quarter"].to_numpy(dtype=np.int64))
+
+
 def run(*, args: Args):
+    global lookup
     assert not pth.Path(args["output"]).exists()
-    events = pd.concat([pd.read_csv(name) for name in args["events"]])
-    langs = pd.read_csv(args["langs"])
-    events = events.merge(langs[["repo", "lang"]], on="repo")
-    group_keys = ["year", "quarter", "event", "lang"]
-    events = events.groupby(group_keys)[["count"]].sum().reset_index()
+    names = frames.expand(args["events"])
+    # Reuse sums for event files that haven't changed since last time.
+    cache = partitions.PartitionCache(args["cache"]) if args["cache"] else None
+    parts: dict[str, pd.DataFrame] = {}
+    if cache:
+        for name in names:
+            part = cache.load(cache_key(name), deps=[name, args["langs"]])
+            if part is not None:
+                parts[name] = part
+        print(f"cached: {len(parts)} / {len(names)}")
+        metrics.count("partition_cache", hits=cache.hits, misses=cache.misses)
+    missing = [name for name in names if name not in parts]
+    if missing:
+        columns = ["repo", "lang"]
+        if {"year", "quarter"} <= set(ghindex.lang_columns(args["langs"])):
+            columns += ["year", "quarter"]
+        with metrics.stage("lookup") as stage:
+            langs = ghindex.read_langs(args["langs"], columns=columns)
+            stage.count("langs", len(langs))
+            lookup = LangLookup(langs)
+            del langs
+        with metrics.stage("merge") as stage:
+            stage.count("files", len(missing))
+            for name, part in zip(missing, merge_files(missing, args=args)):
+                if cache:
+                    cache.store(cache_key(name), part, deps=[name, args["langs"]])
+                parts[name] = part
+    events = fold([parts[name].set_index(group_keys) for name in names])
+    events.reset_index(inplace=True)
     events.sort_values(
         ascending=[True, True, True, False],
         by=["year", "quarter", "event", "count"],
         inplace=True,
     )
-    events.to_csv(args["output"], index=False)
+    metrics.count("rows", len(events))
+    frames.write_frame(events, args["output"])
+
+
+def version_keys(repo_codes: np.ndarray, times: np.ndarray) -> np.ndarray:
+    # Quarter numbers stay well under 2**20 for any plausible year.
+    return (repo_codes.astype(np.int64) << 20) | times
 
 
 if __name__ == "__main__":
-    main()
+    metrics.run(main)
@@ -1,4 +1,6 @@
 import argparse
+import frames
+import metrics
 import pandas as pd
 import pathlib as pth
 import typing as typ
@@ -7,18 +9,20 @@ import typing as typ
 class Args(typ.TypedDict):
     csv: str
     outdir: str
+    splice: bool
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--csv", required=True)
     parser.add_argument("--outdir", required=True)
+    parser.add_argument("--splice", action="store_true")
     args = parser.parse_args().__dict__
     run(args=args)
 
 
 def run(*, args: Args):
-    counts = pd.read_csv(args["csv"])
+    counts = frames.read_frame(args["csv"])
     counts.rename(columns={"lang": "name"}, inplace=True)
     counts = counts[counts["year"] >= 2012]
     outdir = pth.Path(args["outdir"])
@@ -28,11 +32,26 @@ def run(*, args: Args):
         "WatchEvent": "gh-star-event",
     }
     group: pd.DataFrame
-    for event, group in counts.groupby("event"):
+    for event, group in counts.groupby("event", observed=True):
         path = outdir / f"{file_names[event]}.json"
         group = group.drop(columns="event")
+        if args["splice"] and path.exists():
+            group = splice(pd.read_json(path), group)
         group.to_json(path, indent=2, orient="records")
+        metrics.count("rows", len(group), event=event)
+
+
+def splice(old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """Replaces just the quarters that new covers."""
+    quarters = new[["year", "quarter"]].drop_duplicates()
+    old = old.merge(quarters, how="left", indicator=True)
+    old = old[old["_merge"] == "left_only"].drop(columns="_merge")
+    spliced = pd.concat([old, new[old.columns]])
+    spliced.sort_values(
+        ascending=[True, True, False], by=["year", "quarter", "count"], inplace=True
+    )
+    return spliced
 
 
 if __name__ == "__main__":
-    main()
+    metrics.run(main)
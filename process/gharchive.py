@@ -0,0 +1,231 @@
+import argparse
+import collections
+import concurrent.futures as cf
+import contextlib
+import csv
+import datetime
+import frames
+import functools
+import gzip
+import json
+import metrics
+import multiprocessing
+import pandas as pd
+import pathlib as pth
+import re
+import tempfile
+import typing as typ
+import zlib
+
+
+class Args(typ.TypedDict):
+    events: list[str]
+    inputs: list[str]
+    min_count: int
+    output: str
+    partitions: int
+    workers: int | None
+
+
+class Spill(typ.NamedTuple):
+    """Counts from one archive file, as tsv text by quarter and partition."""
+
+    bad_lines: int
+    kept: int
+    lines: int
+    name: str
+    parts: dict[tuple[int, int, int], str]
+    truncated: bool
+
+
+default_events = ["IssuesEvent", "PullRequestEvent", "WatchEvent"]
+# Same as the ghEvents query's regexp_replace on repo.url.
+url_prefix = re.compile(r"https://github\.com/|https://api\.github\.com/repos/")
+
+
+def iter_bounded(
+    executor: cf.Executor,
+    fun: typ.Callable[[str], Spill],
+    names: list[str],
+    *,
+    window: int,
+) -> typ.Iterator[Spill]:
+    """Yields results as they finish, with at most window of them in flight.
+
+    Unlike executor.map, this doesn't submit everything up front, so finished
+    spills can't pile up in memory when writing them falls behind.
+    """
+    pending: set[cf.Future[Spill]] = set()
+    for name in names:
+        if len(pending) >= window:
+            done, pending = cf.wait(pending, return_when=cf.FIRST_COMPLETED)
+            yield from (future.result() for future in done)
+        pending.add(executor.submit(fun, name))
+    for future in cf.as_completed(pending):
+        yield future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", default=default_events, nargs="+")
+    parser.add_argument(
+        "--inputs", nargs="+", required=True, help="hourly .json.gz files or globs"
+    )
+    parser.add_argument("--min-count", default=10, type=int)
+    parser.add_argument("--output", required=True)
+    parser.add_argument(
+        "--partitions",
+        default=16,
+        type=int,
+        help="repo hash spills per quarter, to bound memory when summing",
+    )
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args().__dict__
+    run(args=args)
+
+
+def quarter_of(created_at: str) -> tuple[int, int]:
+    # Archives before 2015 give local times with offsets, unlike later Z times.
+    if not created_at.endswith("Z"):
+        created = datetime.datetime.fromisoformat(created_at)
+        created_at = created.astimezone(datetime.timezone.utc).isoformat()
+    return int(created_at[:4]), (int(created_at[5:7]) - 1) // 3 + 1
+
+
+def read_archive(name: str, *, events: list[str], partitions: int) -> Spill:
+    """Counts events by quarter, type, and repo for one archive file."""
+    needles = [f'"{event}"'.encode() for event in events]
+    wanted = set(events)
+    counts: collections.Counter[tuple[int, int, str, str]] = collections.Counter()
+    bad_lines = lines = 0
+    truncated = False
+    opener = gzip.open if name.endswith(".gz") else open
+    with opener(name, "rb") as input:
+        try:
+            for line in input:
+                lines += 1
+                # Skip parsing most lines, which are other event types.
+                if not any(needle in line for needle in needles):
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    bad_lines += 1
+                    continue
+                if event.get("type") not in wanted:
+                    continue
+                # Older archives say repository rather than repo.
+                repo = event.get("repo") or event.get("repository") or {}
+                url = repo.get("url")
+                if not url:
+                    continue
+                year, quarter = quarter_of(event["created_at"])
+                counts[year, quarter, event["type"], url_prefix.sub("", url)] += 1
+        except (EOFError, zlib.error, gzip.BadGzipFile):
+            # Some archive hours are cut short, so keep what came before.
+            truncated = True
+    lines_by_part: dict[tuple[int, int, int], list[str]] = collections.defaultdict(list)
+    for (year, quarter, event, repo), count in counts.items():
+        part = zlib.crc32(repo.encode()) % partitions
+        lines_by_part[year, quarter, part].append(
+            f"{year}\t{quarter}\t{event}\t{repo}\t{count}\n"
+        )
+    return Spill(
+        bad_lines=bad_lines,
+        kept=counts.total(),
+        lines=lines,
+        name=name,
+        parts={key: "".join(part) for key, part in lines_by_part.items()},
+        truncated=truncated,
+    )
+
+
+def read_spill(name: pth.Path) -> pd.DataFrame:
+    return pd.read_csv(
+        name,
+        dtype={"event": "category", "repo": str},
+        encoding="utf-8",
+        header=None,
+        keep_default_na=False,
+        names=["year", "quarter", "event", "repo", "count"],
+        quoting=csv.QUOTE_NONE,
+        sep="\t",
+    )
+
+
+def reduce_spill(name: pth.Path, *, min_count: int) -> pd.DataFrame:
+    spill = read_spill(name)
+    counts = spill.groupby(["year", "quarter", "event", "repo"], observed=True).sum()
+    counts = counts[counts["count"] >= min_count]
+    return counts.reset_index()
+
+
+def run(*, args: Args):
+    """Sums events per repo and quarter like the ghEvents query, but locally.
+
+    Workers each count one archive file at a time, spilling counts to disk by
+    quarter and repo hash, so summing needs only one partition in memory.
+    """
+    output = pth.Path(args["output"])
+    assert not output.exists(), f"output exists: {output}"
+    names = frames.expand(args["inputs"])
+    read = functools.partial(
+        read_archive, events=args["events"], partitions=args["partitions"]
+    )
+    with tempfile.TemporaryDirectory(dir=output.parent, prefix="gharchive-") as dir:
+        spill_names: dict[tuple[int, int, int], pth.Path] = {}
+        with metrics.stage("read") as info, contextlib.ExitStack() as stack:
+            if args["workers"]:
+                executor = cf.ProcessPoolExecutor(
+                    max_workers=args["workers"],
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                spills = iter_bounded(
+                    stack.enter_context(executor),
+                    read,
+                    names,
+                    window=2 * args["workers"],
+                )
+            else:
+                spills = map(read, names)
+            outs: dict[tuple[int, int, int], typ.TextIO] = {}
+            for spill in spills:
+                for key, text in spill.parts.items():
+                    if key not in outs:
+                        year, quarter, part = key
+                        spill_names[key] = (
+                            pth.Path(dir) / f"{year}-{quarter}-{part}.tsv"
+                        )
+                        outs[key] = stack.enter_context(
+                            open(spill_names[key], "w", encoding="utf-8")
+                        )
+                    outs[key].write(text)
+                info.count("bad_lines", spill.bad_lines)
+                info.count("files", 1)
+                info.count("kept", spill.kept)
+                info.count("lines", spill.lines)
+                if spill.truncated:
+                    print(f"truncated: {spill.name}")
+                    info.count("truncated", 1)
+        with metrics.stage("sum"):
+            parts = [
+                reduce_spill(spill_names[key], min_count=args["min_count"])
+                for key in sorted(spill_names)
+            ]
+    columns = ["year", "quarter", "count", "event", "repo"]
+    if parts:
+        counts = pd.concat(parts, ignore_index=True)[columns]
+    else:
+        counts = pd.DataFrame(columns=columns)
+    counts.sort_values(
+        ascending=[True, True, False, True, True],
+        by=["year", "quarter", "count", "event", "repo"],
+        ignore_index=True,
+        inplace=True,
+    )
+    metrics.count("rows", len(counts))
+    frames.write_frame(counts, output)
+
+
+if __name__ == "__main__":
+    metrics.run(main)
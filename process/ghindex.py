@@ -0,0 +1,163 @@
+import frames
+import pandas as pd
+import pathlib as pth
+import re
+import repos
+import sqlite3
+import typing as typ
+
+file_name = "index.sqlite"
+
+schema = """
+    create table if not exists chunks (
+        name text primary key,
+        number integer not null
+    );
+    create table if not exists repos (
+        repo text not null,
+        found integer not null,
+        fork integer,
+        lang text not null,
+        chunk text not null,
+        primary key (repo, found, lang)
+    ) without rowid;
+    create table if not exists aliases (
+        old text primary key,
+        new text not null
+    ) without rowid;
+"""
+
+
+class RepoIndex:
+    """Append-only record of which repos each landed chunk resolved."""
+
+    def __init__(self, path: str | pth.Path):
+        self.path = pth.Path(path)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(schema)
+        (version,) = self.connection.execute("pragma user_version").fetchone()
+        if version < 1:
+            # Older indexes kept names as GitHub cased them, so fold those in
+            # chunk order to keep the first seen.
+            with self.connection:
+                self.connection.execute(
+                    "create temp table cased as select * from repos"
+                )
+                self.connection.execute("delete from repos")
+                self.connection.execute(
+                    "insert or ignore into repos"
+                    " select lower(repo), found, fork, lang, chunk from cased"
+                    " left join chunks on chunks.name = cased.chunk order by number"
+                )
+                self.connection.execute("drop table cased")
+                self.connection.execute("pragma user_version = 1")
+
+    def __contains__(self, repo: str) -> bool:
+        cursor = self.connection.execute(
+            "select 1 from repos where repo = ?"
+            " union all select 1 from aliases where old = ? limit 1",
+            (repo, repo),
+        )
+        return cursor.fetchone() is not None
+
+    def add(
+        self,
+        *,
+        aliases: typ.Iterable[tuple[str, str]] = (),
+        chunk: str,
+        rows: typ.Iterable[typ.Any],
+    ):
+        """Records a chunk and its repos, first sighting winning on conflict.
+
+        Rows need fork, found, lang, and repo attributes, as from
+        ghmerge.extract_rows or DataFrame.itertuples. Aliases are old and new
+        names of renamed repos, as from ghmerge.extract_aliases.
+        """
+        values = [
+            (row.repo, bool(row.found), fork_value(row.fork), row.lang, chunk)
+            for row in rows
+        ]
+        with self.connection:
+            self.connection.executemany(
+                "insert or ignore into repos values (?, ?, ?, ?, ?)", values
+            )
+            self.connection.executemany(
+                "insert or replace into aliases values (?, ?)", aliases
+            )
+            self.connection.execute(
+                "insert or ignore into chunks values (?, ?)",
+                (chunk, chunk_number(chunk)),
+            )
+
+    def aliases(self) -> dict[str, str]:
+        return dict(self.connection.execute("select old, new from aliases"))
+
+    def chunks(self) -> set[str]:
+        return {name for name, in self.connection.execute("select name from chunks")}
+
+    def close(self):
+        self.connection.close()
+
+    def frame(self) -> pd.DataFrame:
+        """Gives every repo row in the order chunks landed, first seen first.
+
+        Old names of renamed repos also get rows, through any chain of renames,
+        since events still use them.
+        """
+        langs = pd.read_sql_query(
+            """
+                select fork, found, lang, repo, chunk path, number from repos
+                left join chunks on chunks.name = repos.chunk
+            """,
+            self.connection,
+        )
+        aliases = repos.resolve_aliases(self.aliases().items())
+        known = set(langs["repo"])
+        olds = pd.Series([old for old in aliases if old not in known], dtype=object)
+        renames = pd.DataFrame({"repo": olds, "new": olds.map(aliases)})
+        renamed = renames.merge(langs.rename(columns={"repo": "new"}), on="new")
+        langs = pd.concat([langs, renamed.drop(columns="new")], ignore_index=True)
+        langs.sort_values(
+            by=["number", "path", "repo", "lang"], ignore_index=True, inplace=True
+        )
+        langs.drop(columns="number", inplace=True)
+        langs["found"] = langs["found"].astype(bool)
+        langs["fork"] = langs["fork"].map({0: False, 1: True})
+        langs["path"] = [str(self.path.parent / name) for name in langs["path"]]
+        return langs
+
+    def next_chunk(self) -> int:
+        (number,) = self.connection.execute("select max(number) from chunks").fetchone()
+        return 0 if number is None else number + 1
+
+
+def chunk_number(name: str) -> int:
+    match = re.match(r"chunk(\d+)\.", name)
+    return int(match.group(1)) if match else -1
+
+
+def fork_value(fork: typ.Any) -> bool | None:
+    return None if pd.isnull(fork) else bool(fork)
+
+
+def lang_columns(name: str) -> list[str]:
+    """Gives the columns read_langs would, without reading rows."""
+    if pth.Path(name).suffix == ".sqlite":
+        return ["fork", "found", "lang", "repo", "path"]
+    return frames.column_names(name)
+
+
+def open_index(dir: str | pth.Path) -> RepoIndex:
+    return RepoIndex(pth.Path(dir) / file_name)
+
+
+def read_langs(name: str, *, columns: list[str] | None = None) -> pd.DataFrame:
+    """Reads a langs table from a frame file or a chunk dir's index."""
+    if pth.Path(name).suffix == ".sqlite":
+        index = RepoIndex(name)
+        try:
+            langs = index.frame()
+        finally:
+            index.close()
+        return langs if columns is None else langs[columns]
+    return frames.read_frame(name, columns=columns)
@@ -1,14 +1,23 @@
 import argparse
+import concurrent.futures as cf
+import frames
+import ghindex
+import ghstore
 import json
+import langresolve
+import metrics
+import multiprocessing
 import pandas as pd
 import pathlib as pth
 import re
+import repos
 import typing as typ
 
 
 class Args(typ.TypedDict):
     jsondir: str
     output: str
+    workers: int | None
 
 
 class Error(typ.TypedDict):
@@ -25,56 +34,102 @@ class Repo(typ.TypedDict):
     primaryLanguage: Language | None
 
 
-class Row(typ.TypedDict):
+class Row(typ.NamedTuple):
     fork: bool | None
     found: bool
     lang: str
     repo: str
+    path: str
 
 
-def extract_data(data: dict[str, Repo | None], path: pth.Path) -> pd.DataFrame:
+def extract_aliases(
+    data: dict[str, Repo | None], queried: typ.Sequence[str]
+) -> list[tuple[str, str]]:
+    """Pairs queried names with what GitHub says now, where renamed.
+
+    Only works live, since chunks don't keep which names got queried.
+    """
+    aliases = []
+    for key, obj in data.items():
+        if obj is not None and key != "rateLimit":
+            # Keys are r{index} into the queried repos.
+            old = queried[int(key[1:])]
+            new = repos.canonical(obj["nameWithOwner"])
+            if new is not None and old != new:
+                aliases.append((old, new))
+    return aliases
+
+
+def extract_rows(data: dict[str, Repo | None], path: pth.Path) -> list[Row]:
     rows = []
-    for obj in data.values():
-        if obj is not None:
+    for key, obj in data.items():
+        # Queries also ask for rateLimit beside the repos.
+        if obj is not None and key != "rateLimit":
             lang = obj["primaryLanguage"]
-            row: Row = {
-                "fork": obj["isFork"],
-                "found": True,
-                "lang": normalize_name(lang["name"]) if lang else "",
-                "repo": obj["nameWithOwner"],
-                "path": path,
-            }
+            row = Row(
+                fork=obj["isFork"],
+                found=True,
+                lang=normalize_name(lang["name"]) if lang else "",
+                repo=repos.canonical(obj["nameWithOwner"]) or obj["nameWithOwner"],
+                path=str(path),
+            )
             rows.append(row)
-    return pd.DataFrame(rows)
+    return rows
 
 
 def extract_errors(errors: list[Error]) -> pd.DataFrame:
     rows = []
-    pattern = re.compile(r"'([^/]*/[^/]*)'")
+    pattern = re.compile(r"'([^/']*/[^/']*)'")
     for err in errors:
         match = pattern.search(err["message"])
-        if match:
-            row = {"fork": None, "found": False, "lang": "", "repo": match.group(1)}
+        repo = match and repos.canonical(match.group(1))
+        if repo:
+            row = {"fork": None, "found": False, "lang": "", "repo": repo}
             rows.append(row)
     return pd.DataFrame(rows)
 
 
-def load_projects(dir: str) -> pd.DataFrame:
-    parts = []
-    cwd = pth.Path.cwd()
-    for path in pth.Path(dir).iterdir():
-        with open(path) as input:
-            try:
-                response = json.load(input)
-            except:
-                print(f"Error reading: {path}")
-                raise
-        path = path.resolve().relative_to(cwd)
-        data = extract_data(response.get("data") or {}, path=path)
-        # errors = extract_errors(response.get("errors", []))
-        # parts += [data, errors]
-        parts.append(data)
-    return pd.concat(parts).drop_duplicates(subset=["found", "lang", "repo"])
+def chunk_paths(dir: str | pth.Path) -> list[pth.Path]:
+    pattern = re.compile(r"chunk\d+\.json")
+    return [path for path in pth.Path(dir).iterdir() if pattern.fullmatch(path.name)]
+
+
+def iter_chunk_rows(
+    paths: list[pth.Path], *, workers: int | None = None
+) -> typ.Iterator[tuple[pth.Path, list[Row]]]:
+    """Parses chunks one at a time, or across a process pool if workers."""
+    yield from zip(paths, map_paths(read_chunk, paths, workers=workers))
+
+
+def iter_dir_rows(
+    dir: str | pth.Path, *, known: set[str] = set(), workers: int | None = None
+) -> typ.Iterator[tuple[str, list[Row]]]:
+    """Gives rows by chunk name from json chunks and segments, skipping known."""
+    seen = set(known)
+    paths = [path for path in chunk_paths(dir) if path.name not in seen]
+    for path, rows in iter_chunk_rows(paths, workers=workers):
+        seen.add(path.name)
+        yield path.name, rows
+    # Only decompress segments holding something new.
+    locations = ghstore.read_index(pth.Path(dir))
+    segments = {loc.segment for name, loc in locations.items() if name not in seen}
+    paths = [
+        ghstore.segment_path(pth.Path(dir), segment) for segment in sorted(segments)
+    ]
+    for records in map_paths(read_segment, paths, workers=workers):
+        for name, rows in records:
+            # Unindexed records are leftovers from interrupted writes.
+            if name in locations and name not in seen:
+                seen.add(name)
+                yield name, rows
+
+
+def load_index(dir: str | pth.Path, *, workers: int | None = None) -> ghindex.RepoIndex:
+    """Opens the dir's repo index, first adding any chunks it's missing."""
+    index = ghindex.open_index(dir)
+    for name, rows in iter_dir_rows(dir, known=index.chunks(), workers=workers):
+        index.add(chunk=name, rows=rows)
+    return index
 
 
 def main():
@@ -82,10 +137,28 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--jsondir", required=True)
     parser.add_argument("--output", required=True)
+    parser.add_argument("--workers", type=int)
     args = parser.parse_args().__dict__
     run(args=args)
 
 
+def map_paths(
+    fun: typ.Callable[[pth.Path], typ.Any],
+    paths: list[pth.Path],
+    *,
+    workers: int | None = None,
+) -> typ.Iterator[typ.Any]:
+    if not workers:
+        yield from map(fun, paths)
+        return
+    with cf.ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        # Bigger task batches keep per-file pickling overhead down.
+        chunksize = max(1, min(64, len(paths) // (4 * workers)))
+        yield from executor.map(fun, paths, chunksize=chunksize)
+
+
 def normalize_name(name: str) -> str:
     if name == "Vim script":
         # GitHub changed this later, so normalize it.
@@ -93,21 +166,45 @@ def normalize_name(name: str) -> str:
     return name
 
 
+def read_chunk(path: pth.Path) -> list[Row]:
+    with open(path) as input:
+        try:
+            response = json.load(input)
+        except:
+            print(f"Error reading: {path}")
+            raise
+    path = path.resolve().relative_to(pth.Path.cwd())
+    rows = extract_rows(response.get("data") or {}, path=path)
+    # errors = extract_errors(response.get("errors", []))
+    return rows
+
+
+def read_segment(path: pth.Path) -> list[tuple[str, list[Row]]]:
+    return [
+        (name, extract_rows(response.get("data") or {}, path=path.parent / name))
+        for name, response in ghstore.iter_segment(path)
+    ]
+
+
 def run(*, args: Args):
     assert not pth.Path(args["output"]).exists()
-    langs = load_projects(args["jsondir"])
-    # Check for strangeness.
-    dupe_counts = langs.drop_duplicates().groupby("repo")["lang"].count()
-    multis = dupe_counts[dupe_counts > 1].index
-    contras = langs[langs["repo"].isin(multis)].sort_values(by=["repo", "lang"])
-    print("Contradictions")
-    print(contras)
-    # Then arbitrarily move on.
+    with metrics.stage("load index") as stage:
+        index = load_index(args["jsondir"], workers=args["workers"])
+        langs = index.frame()
+        index.close()
+        stage.count("rows", len(langs))
+    # Check for strangeness, then keep the first seen for each.
     # I had 4 repos in this category early on. Now many.
-    contras.to_csv(pth.Path(args["output"]).parent / "contras.csv", index=False)
-    langs = langs.drop_duplicates(subset="repo")
-    langs.to_csv(args["output"], index=False)
+    resolution = langresolve.resolve([langs], policy="first")
+    print("Contradictions")
+    print(resolution.conflicts)
+    print(resolution.stats)
+    metrics.count("resolved", **resolution.stats)
+    path = pth.Path(args["output"]).parent / "contras.csv"
+    resolution.conflicts.to_csv(path, index=False)
+    langs = resolution.langs
+    frames.write_frame(langs, args["output"])
 
 
 if __name__ == "__main__":
-    main()
+    metrics.run(main)
@@ -1,12 +1,21 @@
 import argparse
-from unicodedata import name
+import collections
+import concurrent.futures as cf
+import datetime as dt
+import frames
 import ghmerge
+import ghstore
+import httpcache
 import json
+import metrics
+import net
 import os
 import pandas as pd
 import pathlib as pth
-import re
+import repocounts
+import repos
 import requests
+import threading
 import time
 import traceback
 import typing as typ
@@ -14,9 +23,129 @@ import urllib3
 
 
 class Args(typ.TypedDict):
+    batch_rows: int
+    batch_size: int
+    cache: str | None
+    cache_ttl: float | None
     dones: str
+    endpoint: str
     events: list[str]
+    format: typ.Literal["json", "segments"]
+    min_count: int | None
+    offline: bool
     outdir: str
+    retries: int
+    sketch_width: int | None
+    target_seconds: float
+    workers: int
+
+
+class BatchFailed(Exception):
+    pass
+
+
+class Batcher:
+    """Adapts how many repos go in each query from how recent ones went."""
+
+    def __init__(self, *, max_cost: int = 1, max_size: int, target_seconds: float):
+        self.lock = threading.Lock()
+        self.max_cost = max_cost
+        self.max_size = max_size
+        self.min_size = 1
+        self.size = float(max_size)
+        self.target_seconds = target_seconds
+
+    def observe(self, *, cost: int | None, count: int, failed: bool, seconds: float):
+        with self.lock:
+            size = self.size
+            if failed:
+                # Back off hard on failure, like TCP.
+                size /= 2
+            else:
+                if seconds > self.target_seconds:
+                    size *= self.target_seconds / seconds
+                elif count >= int(size):
+                    # Only grow when full batches are going well.
+                    size += max(1.0, size / 10)
+                if cost is not None and cost > self.max_cost:
+                    # Past here, more repos per query buys nothing.
+                    size = min(size, count * self.max_cost / cost)
+            self.size = min(max(size, self.min_size), self.max_size)
+
+    def take(self) -> int:
+        with self.lock:
+            return int(self.size)
+
+
+class ChunkStats(typ.TypedDict):
+    cost: int | None
+    remaining: int | None
+    response: dict
+    seconds: float
+
+
+class Pacer:
+    """Spreads requests over what's left of the current rate limit window."""
+
+    def __init__(self, *, reserve: int = 50):
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+        self.remaining: int | None = None
+        self.reserve = reserve
+        self.reset_at = 0.0
+
+    def pause(self):
+        """Holds everyone until the window resets, after GitHub says we're out."""
+        with self.lock:
+            now = time.time()
+            self.remaining = 0
+            # Without a known reset, a minute is a fair guess.
+            reset_at = self.reset_at if self.reset_at > now else now + 60
+            self.next_time = max(self.next_time, reset_at + 1)
+
+    def update(self, response: requests.Response):
+        headers = response.headers
+        remaining = headers.get("x-ratelimit-remaining")
+        reset_at = headers.get("x-ratelimit-reset")
+        retry_after = headers.get("retry-after")
+        try:
+            rate_limit = (response.json().get("data") or {}).get("rateLimit")
+        except ValueError:
+            rate_limit = None
+        with self.lock:
+            now = time.time()
+            if rate_limit:
+                # The body is per query, so prefer it to headers.
+                remaining = rate_limit["remaining"]
+                reset_at = parse_time(rate_limit["resetAt"])
+            if remaining is not None and reset_at is not None:
+                self.remaining = int(remaining)
+                self.reset_at = float(reset_at)
+            if retry_after is not None:
+                # Secondary limits pause everyone.
+                self.next_time = max(self.next_time, now + float(retry_after))
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            interval = 0.0
+            if self.remaining is not None and self.reset_at > now:
+                spare = self.remaining - self.reserve
+                if spare <= 0:
+                    # Out of budget, so sit out the window.
+                    self.next_time = max(self.next_time, self.reset_at + 1)
+                else:
+                    interval = (self.reset_at - now) / spare
+                self.remaining -= 1
+            start = max(now, self.next_time)
+            self.next_time = start + interval
+        delay = start - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Unavailable(Exception):
+    """Transient failures outlasted every retry, so splitting won't help."""
 
 
 # class EventRow(typ.TypedDict):
@@ -29,15 +158,14 @@ class Args(typ.TypedDict):
 
 def build_query(chunk: pd.DataFrame) -> pd.DataFrame:
     parts = ["query {"]
-    for index, repo in enumerate(chunk["repo"]):
-        try:
-            owner, name = [json.dumps(part) for part in repo.split("/")]
-        except ValueError:
-            # print(f"bad: {repo}")
-            continue
+    # Repos are already canonical, so each splits cleanly.
+    names = repos.split_owner_name(chunk["repo"])
+    for index, (owner, name) in enumerate(zip(names["owner"], names["name"])):
+        owner, name = json.dumps(owner), json.dumps(name)
         start = f"r{index}: repository(owner: {owner}, name: {name})"
         parts += [f"  {start} {{nameWithOwner isFork primaryLanguage {{name}}}}"]
-    # parts += ["  rateLimit(dryRun: true) {cost limit nodeCount remaining resetAt used}"]
+    # Costs nothing extra and lets us pace from what GitHub reports.
+    parts += ["  rateLimit {cost limit nodeCount remaining resetAt used}"]
     parts += ["}"]
     query = "\n".join(parts)
     # print(query)
@@ -47,102 +175,310 @@ def build_query(chunk: pd.DataFrame) -> pd.DataFrame:
 endpoint = "https://api.github.com/graphql"
 
 
-def init_client():
-    session = requests.Session()
-    session.headers.update({"Authorization": f"Bearer {os.environ['GITHUB_TOKEN']}"})
-    return session
+# Transient failures worth retrying rather than dropping the chunk.
+# All these things appear in the nested exceptions.
+transient_errors = (
+    urllib3.exceptions.InvalidChunkLength,
+    urllib3.exceptions.ProtocolError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    ValueError,
+)
+
+# Statuses GitHub uses for secondary limits and flaky gateways.
+retry_statuses = {403, 429, 500, 502, 503, 504}
+
+
+def fetch(
+    client: requests.Session | httpcache.CachedSession,
+    query: str,
+    *,
+    endpoint: str,
+    pacer: Pacer,
+    retries: int,
+) -> tuple[dict, float]:
+    """Returns the response and its seconds spent waiting on the server."""
+    body = {"query": query}
+    attempt = 0
+    while True:
+        if not (
+            isinstance(client, httpcache.CachedSession)
+            and client.has("POST", endpoint, json=body)
+        ):
+            # Cached answers don't spend any rate limit.
+            pacer.wait()
+        options = {}
+        if isinstance(client, httpcache.CachedSession):
+            options["cacheable"] = has_data
+        try:
+            response = client.post(endpoint, json=body, timeout=60, **options)
+            pacer.update(response)
+            if response.status_code not in retry_statuses:
+                response.raise_for_status()
+                result = response.json()
+                if result.get("data") is not None:
+                    return result, response.elapsed.total_seconds()
+                errors = result.get("errors") or []
+                if any(error.get("type") == "RATE_LIMITED" for error in errors):
+                    # Not the batch's fault, so wait it out without a try.
+                    print("~", end="", flush=True)
+                    pacer.pause()
+                    continue
+                if not any(is_timeout(error) for error in errors):
+                    # Real errors in the batch, so let the caller split it.
+                    raise BatchFailed(errors)
+                problem = "timeout"
+            else:
+                problem = f"status {response.status_code}"
+        except transient_errors as err:
+            problem = type(err).__name__
+        if attempt == retries:
+            message = f"giving up after {attempt + 1} tries: {problem}"
+            if problem == "timeout":
+                # Queries that keep timing out can still do better smaller.
+                raise BatchFailed(message)
+            raise Unavailable(message)
+        print("*", end="", flush=True)
+        time.sleep(2**attempt)
+        attempt += 1
+
+
+def fetch_chunk(
+    client: requests.Session | httpcache.CachedSession,
+    chunk: pd.DataFrame,
+    *,
+    args: Args,
+    name: str,
+    pacer: Pacer,
+    store: ghstore.ChunkStore | None,
+) -> ChunkStats:
+    query = build_query(chunk)
+    response, seconds = fetch(
+        client,
+        query,
+        endpoint=args["endpoint"],
+        pacer=pacer,
+        retries=args["retries"],
+    )
+    metrics.observe("graphql_seconds", seconds)
+    if store is not None:
+        store.add(name, response)
+    else:
+        out = pth.Path(args["outdir"]) / name
+        if out.exists():
+            raise FileExistsError(f"out exists: {out}")
+        with open(out, "w") as output:
+            json.dump(fp=output, indent=2, obj=response)
+    rate_limit = response["data"].get("rateLimit") or {}
+    return {
+        "cost": rate_limit.get("cost"),
+        "remaining": rate_limit.get("remaining"),
+        "response": response,
+        "seconds": seconds,
+    }
+
+
+def has_data(response: requests.Response) -> bool:
+    try:
+        return response.json().get("data") is not None
+    except ValueError:
+        return False
+
+
+def init_client(*, pool_size: int = 10):
+    headers = {"Authorization": f"Bearer {os.environ['GITHUB_TOKEN']}"}
+    return net.init_session(headers=headers, pool_size=pool_size)
+
+
+def is_timeout(error: dict) -> bool:
+    # GitHub gives timeouts no type, just a message saying it might be one.
+    return "timeout" in str(error.get("message", "")).lower()
 
 
 def main():
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--batch-rows", default=1_000_000, help="event rows read at once", type=int
+    )
+    parser.add_argument("--batch-size", default=100, type=int)
+    parser.add_argument("--cache", help="response cache file to share across runs")
+    parser.add_argument("--cache-ttl", help="max cached age in seconds", type=float)
     parser.add_argument("--dones")
+    parser.add_argument("--endpoint", default=endpoint)
     parser.add_argument("--events", nargs="+", required=True)
+    parser.add_argument(
+        "--format",
+        choices=["json", "segments"],
+        default="segments",
+        help="json files per chunk or compressed segments",
+    )
+    parser.add_argument(
+        "--min-count", help="skip repos with fewer total events", type=int
+    )
+    parser.add_argument("--offline", action="store_true", help="replay cache only")
     parser.add_argument("--outdir", required=True)
+    parser.add_argument("--retries", default=5, type=int)
+    parser.add_argument(
+        "--sketch-width",
+        help="sketch counts first to keep only possible repos past min count",
+        type=int,
+    )
+    parser.add_argument("--target-seconds", default=10.0, type=float)
+    parser.add_argument("--workers", default=4, type=int)
     args = parser.parse_args().__dict__
     run(args=args)
 
 
+def parse_time(text: str) -> float:
+    return dt.datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp()
+
+
 def run(*, args: Args):
     outdir = pth.Path(args["outdir"])
-    # Count up events by repo.
-    # repo_totals = collections.defaultdict(lambda: 0)
-    totals = None
-    counts = pd.concat([pd.read_csv(name) for name in args["events"]])
-    print(f"events: {len(counts)}")
-    counts = sum_counts(counts)
-    print(f"repos: {len(counts)}")
+    with metrics.stage("read events") as stage:
+        counted = repocounts.count_repos(
+            frames.expand(args["events"]),
+            batch_rows=args["batch_rows"],
+            min_count=args["min_count"],
+            sketch_width=args["sketch_width"],
+        )
+        counts = counted.counts
+        print(f"events: {counted.events}")
+        stage.count("events", counted.events)
+        print(f"repos: {len(counts)}")
+        stage.count("repos", len(counts))
     if args["dones"]:
         dones = pd.read_csv(args["dones"])
-        counts = trim_dones(counts=counts, dones=dones)
-    if outdir.exists():
-        dones = ghmerge.load_projects(str(outdir))
-        counts = trim_dones(counts=counts, dones=dones)
-        # Figure out the starting index.
-        start = -1
-        for kid in outdir.iterdir():
-            match = re.match(r"chunk(\d+)\.json", kid.name)
-            if match:
-                start = max(start, int(match.group(1)))
-        start += 1
-    else:
-        start = 0
+        dones = repos.normalize(dones["repo"]).dropna()
+        counts = trim_dones(counts=counts, dones=set(dones))
+    outdir.mkdir(exist_ok=True, parents=True)
+    # The index knows what's done without rereading every chunk.
+    index = ghmerge.load_index(outdir)
+    # Events under old names count toward where renamed repos went.
+    aliases = repos.resolve_aliases(index.aliases().items())
+    if aliases:
+        counts = counts.assign(repo=repos.normalize(counts["repo"], aliases=aliases))
+        counts = counts.groupby("repo", as_index=False, observed=True)["count"].sum()
+        counts["repo"] = counts["repo"].astype(object)
+    counts = trim_dones(counts=counts, dones=index)
+    start = index.next_chunk()
     print(f"starting from: {start}")
-    counts = counts[counts["repo"].str.contains("/")]
-    print(f"goods: {len(counts)}")
     counts.sort_values(by=["count", "repo"], ascending=[False, True], inplace=True)
-    client = init_client()
-    outdir.mkdir(exist_ok=True, parents=True)
+    workers = args["workers"]
+    client = init_client(pool_size=workers)
+    cache = None
+    if args["cache"]:
+        cache = httpcache.ResponseCache(args["cache"], ttl=args["cache_ttl"])
+        client = httpcache.CachedSession(client, cache=cache, offline=args["offline"])
+    else:
+        assert not args["offline"], "offline needs a cache"
+    batcher = Batcher(
+        max_size=args["batch_size"], target_seconds=args["target_seconds"]
+    )
+    pacer = Pacer()
+    store = ghstore.ChunkStore(outdir) if args["format"] == "segments" else None
     err_count = 0
     total_count = 0
-    for index, chunk in enumerate(split_frame(counts, chunk_size=100)):
-        total_count += 1
-        try:
-            query = build_query(chunk)
-            # result = client.execute(gql.gql(query))
-            try:
-                response = client.post(endpoint, json={"query": query})
-            except (
-                # All these things appear in the nested exceptions.
-                # To be sloppy, just ignore them all.
-                urllib3.exceptions.InvalidChunkLength,
-                urllib3.exceptions.ProtocolError,
-                requests.exceptions.ChunkedEncodingError,
-                ValueError,
+    # Halves of failed batches go ahead of fresh repos.
+    retries: collections.deque[pd.DataFrame] = collections.deque()
+    position = 0
+    number = start
+    unavailable: Unavailable | None = None
+    with cf.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending: dict[cf.Future, tuple[str, pd.DataFrame]] = {}
+        while pending or (unavailable is None and (retries or position < len(counts))):
+            # Keep only a bounded number of chunks in flight.
+            while (
+                unavailable is None
+                and len(pending) < 2 * workers
+                and (retries or position < len(counts))
             ):
-                print("*", end="", flush=True)
-                err_count += 1
-                continue
-            # print(result)
-            out = outdir / f"chunk{index + start}.json"
-            if out.exists():
-                raise RuntimeError(f"out exists: {out}")
-            with open(out, "w") as output:
-                json.dump(fp=output, indent=2, obj=response.json())
-                # output.write(response.text)
-            # break
-            print(".", end="", flush=True)
-        except:
-            # Print and continue.
-            err_count += 1
-            traceback.print_exc()
-        time.sleep(10)
-    print(f"\nerrors: {err_count} / {total_count} total")
-
-
-def split_frame(frame: pd.DataFrame, *, chunk_size: int) -> typ.Iterable[pd.DataFrame]:
-    for begin in range(0, len(frame), chunk_size):
-        yield frame.iloc[begin : begin + chunk_size]
-
-
-def sum_counts(counts: pd.DataFrame) -> pd.DataFrame:
-    return counts.groupby("repo")["count"].sum().to_frame().reset_index()
-
-
-def trim_dones(counts: pd.DateOffset, dones: pd.DataFrame) -> pd.DataFrame:
-    counts = counts[~counts["repo"].isin(set(dones["repo"]))]
+                if retries:
+                    chunk = retries.popleft()
+                else:
+                    size = batcher.take()
+                    chunk = counts.iloc[position : position + size]
+                    position += size
+                total_count += 1
+                name = f"chunk{number}.json"
+                number += 1
+                future = executor.submit(
+                    fetch_chunk,
+                    client,
+                    chunk,
+                    args=args,
+                    name=name,
+                    pacer=pacer,
+                    store=store,
+                )
+                pending[future] = name, chunk
+            done, _ = cf.wait(pending, return_when=cf.FIRST_COMPLETED)
+            for future in done:
+                name, chunk = pending.pop(future)
+                try:
+                    stats = future.result()
+                except Unavailable as err:
+                    # An outage isn't any repo's fault, so stop asking and
+                    # leave the rest for a later run to resume.
+                    err_count += 1
+                    unavailable = unavailable or err
+                    print(f"{name}: stopping after {err}")
+                    continue
+                except (BatchFailed, httpcache.OfflineMiss) as err:
+                    # Replays only match the batches of the recorded run, so
+                    # misses bisect too, toward the halves it recorded.
+                    batcher.observe(cost=None, count=len(chunk), failed=True, seconds=0)
+                    if len(chunk) > 1:
+                        # Bisect to isolate any poison repos.
+                        half = len(chunk) // 2
+                        retries.extend([chunk.iloc[:half], chunk.iloc[half:]])
+                        print(f"{name}: split {len(chunk)} repos after {err}")
+                    else:
+                        err_count += 1
+                        print(f"{name}: poison {chunk['repo'].iloc[0]}: {err}")
+                    continue
+                except:
+                    # Print and continue.
+                    err_count += 1
+                    traceback.print_exc()
+                    continue
+                data = stats["response"]["data"]
+                index.add(
+                    aliases=ghmerge.extract_aliases(
+                        data, queried=chunk["repo"].tolist()
+                    ),
+                    chunk=name,
+                    rows=ghmerge.extract_rows(data, path=name),
+                )
+                batcher.observe(
+                    cost=stats["cost"],
+                    count=len(chunk),
+                    failed=False,
+                    seconds=stats["seconds"],
+                )
+                print(
+                    f"{name}: {len(chunk)} repos, cost {stats['cost']}, "
+                    f"{stats['seconds']:.1f}s, remaining {stats['remaining']}, "
+                    f"next batch {batcher.take()}"
+                )
+    index.close()
+    if store is not None:
+        store.close()
+    print(f"errors: {err_count} / {total_count} total")
+    metrics.count("chunks", errors=err_count, total=total_count)
+    if cache:
+        print(cache.report())
+        metrics.count("http_cache", **cache.stats())
+    if unavailable is not None:
+        raise unavailable
+
+
+def trim_dones(counts: pd.DataFrame, dones: typ.Container[str]) -> pd.DataFrame:
+    counts = counts[[repo not in dones for repo in counts["repo"]]]
     print(f"remaining: {len(counts)}")
     return counts
 
 
 if __name__ == "__main__":
-    main()
+    metrics.run(main)
@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import pathlib as pth
+import re
+import struct
+import threading
+import typing as typ
+import zlib
+
+index_name = "segments.idx"
+# Name length then payload length, ahead of each record's bytes.
+record_header = struct.Struct("<II")
+segment_pattern = re.compile(r"segment(\d+)\.bin")
+
+
+class Args(typ.TypedDict):
+    jsondir: str
+    remove: bool
+
+
+class Location(typ.NamedTuple):
+    segment: int
+    offset: int
+    size: int
+
+
+class ChunkStore:
+    """Appends compressed chunk responses into rolling segment files.
+
+    Each record is a header, the chunk name, and zlib-compressed compact json.
+    The index file gets one tab-separated line per record once its bytes are
+    flushed, so anything past the last indexed record is a torn write and
+    gets cut off on reopening, as does any torn index line. A missing index
+    gets rebuilt from the segments.
+    """
+
+    def __init__(self, dir: str | pth.Path, *, max_bytes: int = 64 << 20):
+        self.dir = pth.Path(dir)
+        self.dir.mkdir(exist_ok=True, parents=True)
+        self.lock = threading.Lock()
+        index_path = self.dir / index_name
+        if index_path.exists():
+            trim_index(index_path)
+        elif segment_paths(self.dir):
+            # Recover locations from the records rather than lose segments.
+            rebuild_index(self.dir)
+        self.locations = read_index(self.dir)
+        self.max_bytes = max_bytes
+        self.index = open(self.dir / index_name, "a")
+        ends: dict[int, int] = {}
+        for segment, offset, size in self.locations.values():
+            ends[segment] = max(ends.get(segment, 0), offset + size)
+        self.segment = max(ends, default=0)
+        path = segment_path(self.dir, self.segment)
+        self.output = open(path, "ab")
+        self.output.truncate(ends.get(self.segment, 0))
+        self.output.seek(0, os.SEEK_END)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.locations
+
+    def add(self, name: str, response: dict):
+        payload = zlib.compress(json.dumps(response, separators=(",", ":")).encode())
+        encoded = name.encode()
+        record = record_header.pack(len(encoded), len(payload)) + encoded + payload
+        with self.lock:
+            if name in self.locations:
+                raise FileExistsError(f"chunk exists: {name}")
+            offset = self.output.tell()
+            if offset and offset + len(record) > self.max_bytes:
+                self.output.close()
+                self.segment += 1
+                # Clear out any torn segment left past the indexed ones.
+                self.output = open(segment_path(self.dir, self.segment), "wb")
+                offset = 0
+            self.output.write(record)
+            self.output.flush()
+            location = Location(segment=self.segment, offset=offset, size=len(record))
+            self.index.write("\t".join([name, *map(str, location)]) + "\n")
+            self.index.flush()
+            self.locations[name] = location
+
+    def close(self):
+        self.output.close()
+        self.index.close()
+
+    def names(self) -> list[str]:
+        return list(self.locations)
+
+    def read(self, name: str) -> dict:
+        segment, offset, size = self.locations[name]
+        with open(segment_path(self.dir, segment), "rb") as input:
+            input.seek(offset)
+            return next(iter_records(input, size=size))[1]
+
+
+def iter_records(
+    input: typ.BinaryIO, *, size: int | None = None
+) -> typ.Iterator[tuple[str, dict]]:
+    """Decodes records in sequence, up to size bytes if given."""
+    left = size
+    while left is None or left > 0:
+        header = input.read(record_header.size)
+        if len(header) < record_header.size:
+            break
+        name_size, payload_size = record_header.unpack(header)
+        name = input.read(name_size).decode()
+        payload = input.read(payload_size)
+        if len(payload) < payload_size:
+            # Torn tail, not yet in the index.
+            break
+        yield name, json.loads(zlib.decompress(payload))
+        if left is not None:
+            left -= record_header.size + name_size + payload_size
+
+
+def iter_segment(path: pth.Path) -> typ.Iterator[tuple[str, dict]]:
+    with open(path, "rb") as input:
+        yield from iter_records(input)
+
+
+def trim_index(path: pth.Path):
+    """Cuts any torn line, so the next one doesn't get glued onto it."""
+    with open(path, "r+b") as index:
+        data = index.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            index.truncate(end)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack json chunks into segments.")
+    parser.add_argument("--jsondir", required=True)
+    parser.add_argument("--remove", action="store_true", help="delete packed json")
+    args = parser.parse_args().__dict__
+    run(args=args)
+
+
+def read_index(dir: pth.Path) -> dict[str, Location]:
+    path = dir / index_name
+    locations: dict[str, Location] = {}
+    if path.exists():
+        # Anything after the final newline is a torn write.
+        for line in path.read_text().split("\n")[:-1]:
+            name, *numbers = line.split("\t")
+            locations[name] = Location(*map(int, numbers))
+    return locations
+
+
+def rebuild_index(dir: pth.Path):
+    path = dir / index_name
+    temp = path.with_suffix(".tmp")
+    with open(temp, "w") as index:
+        for segment_file in segment_paths(dir):
+            number = int(segment_pattern.fullmatch(segment_file.name)[1])
+            for name, offset, size in scan_segment(segment_file):
+                index.write("\t".join(map(str, [name, number, offset, size])) + "\n")
+    temp.replace(path)
+
+
+def run(*, args: Args):
+    dir = pth.Path(args["jsondir"])
+    pattern = re.compile(r"chunk(\d+)\.json")
+    paths = [path for path in dir.iterdir() if pattern.fullmatch(path.name)]
+    paths.sort(key=lambda path: int(pattern.fullmatch(path.name).group(1)))
+    store = ChunkStore(dir)
+    before = 0
+    try:
+        for path in paths:
+            if path.name not in store:
+                store.add(path.name, json.loads(path.read_text()))
+            before += path.stat().st_size
+            if args["remove"]:
+                path.unlink()
+    finally:
+        store.close()
+    after = sum(path.stat().st_size for path in segment_paths(dir))
+    print(f"packed {len(paths)} chunks: {before} bytes to {after}")
+
+
+def scan_segment(path: pth.Path) -> typ.Iterator[tuple[str, int, int]]:
+    """Yields name, offset, and size of each whole record, skipping payloads."""
+    size = path.stat().st_size
+    with open(path, "rb") as input:
+        offset = 0
+        while offset + record_header.size <= size:
+            name_size, payload_size = record_header.unpack(
+                input.read(record_header.size)
+            )
+            record_size = record_header.size + name_size + payload_size
+            if offset + record_size > size:
+                break
+            name = input.read(name_size).decode()
+            input.seek(payload_size, os.SEEK_CUR)
+            yield name, offset, record_size
+            offset += record_size
+
+
+def segment_path(dir: pth.Path, segment: int) -> pth.Path:
+    return dir / f"segment{segment}.bin"
+
+
+def segment_paths(dir: str | pth.Path) -> list[pth.Path]:
+    paths = [
+        path for path in pth.Path(dir).iterdir() if segment_pattern.fullmatch(path.name)
+    ]
+    return sorted(
+        paths, key=lambda path: int(segment_pattern.fullmatch(path.name).group(1))
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import datetime as dt
+import hashlib
+import json
+import pathlib as pth
+import requests
+import requests.structures
+import sqlite3
+import threading
+import time
+import typing as typ
+import zlib
+
+schema = """
+    create table if not exists responses (
+        key text primary key,
+        url text not null,
+        created real not null,
+        accessed real not null,
+        status integer not null,
+        headers text not null,
+        body blob not null,
+        size integer not null
+    );
+    create index if not exists responses_accessed on responses (accessed);
+"""
+
+
+class OfflineMiss(LookupError):
+    pass
+
+
+class CachedResponse:
+    """Just enough of requests.Response for what our scripts use."""
+
+    def __init__(self, *, body: bytes, headers: dict[str, str], status: int, url: str):
+        self.content = body
+        self.elapsed = dt.timedelta(0)
+        self.headers = requests.structures.CaseInsensitiveDict(headers)
+        self.status_code = status
+        self.url = url
+
+    def json(self) -> typ.Any:
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} for url: {self.url}")
+
+    @property
+    def text(self) -> str:
+        return self.content.decode()
+
+
+class ResponseCache:
+    """Content-addressed store of compressed responses, keyed by request.
+
+    Entries expire after ttl seconds, if given, and the least recently used
+    get evicted once the total compressed size passes max_bytes.
+    """
+
+    def __init__(
+        self,
+        path: str | pth.Path,
+        *,
+        max_bytes: int = 2 << 30,
+        ttl: float | None = None,
+    ):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(schema)
+        self.hits = 0
+        self.hit_bytes = 0
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.misses = 0
+        self.ttl = ttl
+        (size,) = self.connection.execute("select sum(size) from responses").fetchone()
+        self.size = size or 0
+
+    def get(self, key: str) -> CachedResponse | None:
+        with self.lock:
+            row = self.connection.execute(
+                "select url, created, status, headers, body"
+                " from responses where key = ?",
+                (key,),
+            ).fetchone()
+            now = time.time()
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            url, _, status, headers, body = row
+            with self.connection:
+                self.connection.execute(
+                    "update responses set accessed = ? where key = ?", (now, key)
+                )
+            self.hits += 1
+            self.hit_bytes += len(body)
+        return CachedResponse(
+            body=zlib.decompress(body),
+            headers=json.loads(headers),
+            status=status,
+            url=url,
+        )
+
+    def has(self, key: str) -> bool:
+        with self.lock:
+            row = self.connection.execute(
+                "select created from responses where key = ?", (key,)
+            ).fetchone()
+        return row is not None and (
+            self.ttl is None or time.time() - row[0] <= self.ttl
+        )
+
+    def put(self, key: str, response: requests.Response):
+        body = zlib.compress(response.content)
+        headers = json.dumps(dict(response.headers))
+        now = time.time()
+        with self.lock, self.connection:
+            old = self.connection.execute(
+                "select size from responses where key = ?", (key,)
+            ).fetchone()
+            self.connection.execute(
+                "insert or replace into responses values (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    response.url,
+                    now,
+                    now,
+                    response.status_code,
+                    headers,
+                    body,
+                    len(body),
+                ),
+            )
+            self.size += len(body) - (old[0] if old else 0)
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """Drops least recently used entries until well under the limit."""
+        target = self.max_bytes * 0.9
+        rows = self.connection.execute(
+            "select key, size from responses order by accessed"
+        )
+        dropped = []
+        for key, size in rows:
+            if self.size <= target:
+                break
+            dropped.append((key,))
+            self.size -= size
+        self.connection.executemany("delete from responses where key = ?", dropped)
+
+    def report(self) -> str:
+        stats = self.stats()
+        return (
+            f"cache: {self.hits} hits, {self.misses} misses"
+            f" ({stats['hit_rate']:.0%} hit rate),"
+            f" {self.hit_bytes / 1e6:.1f} MB compressed served"
+        )
+
+    def stats(self) -> dict[str, int | float]:
+        total = self.hits + self.misses
+        return {
+            "hit_bytes": self.hit_bytes,
+            "hit_rate": self.hits / total if total else 0.0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": self.size,
+        }
+
+
+class CachedSession:
+    """Wraps a session to answer from a ResponseCache where possible.
+
+    Offline, misses raise OfflineMiss instead of touching the network.
+    """
+
+    def __init__(
+        self, session: requests.Session, *, cache: ResponseCache, offline: bool = False
+    ):
+        self.cache = cache
+        self.offline = offline
+        self.session = session
+
+    def get(self, url: str, **kwargs) -> requests.Response | CachedResponse:
+        return self.request("GET", url, **kwargs)
+
+    def has(self, method: str, url: str, *, json: typ.Any = None) -> bool:
+        return self.cache.has(request_key(method, url, body=json))
+
+    def post(self, url: str, **kwargs) -> requests.Response | CachedResponse:
+        return self.request("POST", url, **kwargs)
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        cacheable: typ.Callable[[requests.Response], bool] | None = None,
+        json: typ.Any = None,
+        **kwargs,
+    ) -> requests.Response | CachedResponse:
+        """Caches 200 responses, but only those cacheable says are good.
+
+        Some apis give errors with a 200, which shouldn't replay forever.
+        """
+        key = request_key(method, url, body=json)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        if self.offline:
+            raise OfflineMiss(f"not cached: {method} {url}")
+        response = self.session.request(method, url, json=json, **kwargs)
+        if response.status_code == 200 and (cacheable is None or cacheable(response)):
+            self.cache.put(key, response)
+        return response
+
+
+def request_key(method: str, url: str, *, body: typ.Any = None) -> str:
+    text = "" if body is None else json.dumps(body, sort_keys=True)
+    return hashlib.sha256(f"{method} {url}\n{text}".encode()).hexdigest()
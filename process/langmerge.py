@@ -1,6 +1,11 @@
 import argparse
+import frames
+import ghindex
+import langresolve
+import metrics
 import pandas as pd
 import pathlib as pth
+import repos
 import typing as typ
 
 
@@ -8,6 +13,8 @@ class Args(typ.TypedDict):
     drops: list[typ.Literal["empty", "multi"]]
     inputs: list[str]
     output: str
+    policy: langresolve.Policy
+    since: list[str] | None
 
 
 def main():
@@ -15,40 +22,74 @@ def main():
     parser.add_argument("--drops", choices=["empty", "multi"], nargs="+")
     parser.add_argument("--inputs", nargs="+", required=True)
     parser.add_argument("--output", required=True)
+    parser.add_argument(
+        "--policy",
+        choices=langresolve.policies,
+        default="first",
+        help="how to pick among langs for a repo when dropping multi",
+    )
+    parser.add_argument(
+        "--since", help="quarter each input is true from, like 2022Q3", nargs="+"
+    )
     args = parser.parse_args().__dict__
     run(args=args)
 
 
 def run(*, args: Args):
     assert not pth.Path(args["output"]).exists()
+    drops = args["drops"] or []
+    columns = ["fork", "found", "lang", "repo"]
+    sinces = args["since"] or [None] * len(args["inputs"])
+    assert len(sinces) == len(args["inputs"]), "need one since per input"
     parts = []
-    for path in args["inputs"]:
-        print(path)
-        part = pd.read_csv(path)
-        if "bytes" in part:
-            # Keep only primary language.
-            part.sort_values(by=["repo", "bytes"], ascending=[True, False], inplace=True)
-            part.drop_duplicates(inplace=True, subset="repo")
-        if "fork" not in part:
-            part["fork"] = None
-        if "found" not in part:
-            part["found"] = True
-        part = part[["fork", "found", "lang", "repo"]]
-        parts.append(part)
-    langs = pd.concat(parts)
-    print(f"full: {len(langs)}")
-    if "empty" in args["drops"]:
-        langs = langs[~langs["lang"].isnull()]
-        print(f"non-empty: {len(langs)}")
-    if "multi" in args["drops"]:
-        # Load order matters here.
+    part_sinces = []
+    for input, since in zip(args["inputs"], sinces):
+        for path in frames.expand([input]):
+            print(path)
+            part = ghindex.read_langs(path)
+            if "fork" not in part:
+                part["fork"] = None
+            if "found" not in part:
+                part["found"] = True
+            extras = [name for name in ["bytes", "year", "quarter"] if name in part]
+            part = part[columns + extras]
+            part = part.assign(repo=repos.normalize(part["repo"]).astype(object))
+            part = part[~part["repo"].isnull()]
+            if "empty" in drops:
+                # Chunks give "" for no lang, which csv reads back as missing.
+                part = part[~part["lang"].isnull() & (part["lang"] != "")]
+            parts.append(part)
+            part_sinces.append(since and langresolve.parse_quarter(since))
+    print(f"full: {sum(len(part) for part in parts)}")
+    metrics.count("rows", sum(len(part) for part in parts), sources=len(parts))
+    if "multi" in drops:
+        # Load order matters for the first policy.
         # Oldest first avoids anachronism at cost of wrong present status.
-        langs.drop_duplicates(inplace=True, subset="repo")
+        resolution = langresolve.resolve(
+            parts, policy=args["policy"], since=part_sinces
+        )
+        print(f"resolved: {resolution.stats}")
+        metrics.count("resolved", **resolution.stats)
+        langs = resolution.langs
+        if args["policy"] == "ranged":
+            columns += ["year", "quarter"]
+        langs = langs[columns]
     else:
+        # Keep only primary language where sizes tell us.
+        parts = [
+            (
+                langresolve.resolve([part], policy="bytes").langs
+                if "bytes" in part
+                else part
+            )
+            for part in parts
+        ]
+        langs = pd.concat([part[columns] for part in parts])
         langs.drop_duplicates(inplace=True)
     print(f"non-dupe: {len(langs)}")
-    langs.to_csv(args["output"], index=False)
+    metrics.count("non-dupe", len(langs))
+    frames.write_frame(langs, args["output"])
 
 
 if __name__ == "__main__":
-    main()
+    metrics.run(main)
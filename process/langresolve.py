@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+import re
+import typing as typ
+
+Policy = typ.Literal["bytes", "first", "newest", "ranged"]
+policies: list[Policy] = ["bytes", "first", "newest", "ranged"]
+
+
+class Resolution(typ.NamedTuple):
+    conflicts: pd.DataFrame
+    langs: pd.DataFrame
+    stats: "Stats"
+
+
+class Stats(typ.TypedDict):
+    conflicted: int
+    repos: int
+    rows: int
+    # Winning rows by source index.
+    wins: list[int]
+
+
+def parse_quarter(text: str) -> int:
+    """Turns text like 2022Q3 into a quarter count, as in quarter_number."""
+    match = re.fullmatch(r"(\d{4})[Qq]([1-4])", text)
+    assert match, f"bad quarter: {text}"
+    return quarter_number(int(match.group(1)), int(match.group(2)))
+
+
+def quarter_number(year: typ.Any, quarter: typ.Any) -> typ.Any:
+    return year * 4 + quarter - 1
+
+
+def resolve(
+    sources: list[pd.DataFrame],
+    *,
+    policy: Policy = "first",
+    since: list[int | None] | None = None,
+) -> Resolution:
+    """Picks a lang for each repo across sources, in one sort of all rows.
+
+    Sources need repo and lang, and may have bytes, to rank langs within a
+    source, or year and quarter, to say when each row became true. Otherwise
+    since gives a quarter number for a whole source, with load order as the
+    fallback time.
+
+    - first: the earliest loaded source wins.
+    - newest: the latest time wins.
+    - bytes: the most bytes win, where sources have them.
+    - ranged: keeps each change of lang over time, as valid-from year and
+      quarter rows, ready for an as-of lookup.
+
+    Ties within any policy go to the earlier row.
+    """
+    parts = []
+    for index, source in enumerate(sources):
+        if "year" in source and "quarter" in source:
+            time = quarter_number(source["year"], source["quarter"])
+        elif since and since[index] is not None:
+            time = since[index]
+        else:
+            assert policy != "ranged", "ranged needs times for every source"
+            time = index
+        parts.append(source.assign(source=index, time=time))
+    langs = pd.concat(parts, ignore_index=True)
+    langs = langs[~langs["repo"].isnull()].reset_index(drop=True)
+    repo_codes, repo_names = pd.factorize(langs["repo"])
+    lang_codes, lang_names = pd.factorize(langs["lang"])
+    source = langs["source"].to_numpy()
+    time = langs["time"].to_numpy()
+    if "bytes" in langs:
+        sizes = langs["bytes"].fillna(0).to_numpy()
+    else:
+        sizes = np.zeros(len(langs))
+    position = np.arange(len(langs))
+    # Keys from most significant, with lexsort wanting the reverse.
+    keys = {
+        "bytes": [repo_codes, -sizes, source, position],
+        "first": [repo_codes, source, -sizes, position],
+        "newest": [repo_codes, -time, -sizes, position],
+        "ranged": [repo_codes, time, -sizes, position],
+    }[policy]
+    order = np.lexsort(keys[::-1])
+    sorted_repos = repo_codes[order]
+    starts = np.ones(len(order), dtype=bool)
+    starts[1:] = sorted_repos[1:] != sorted_repos[:-1]
+    if policy == "ranged":
+        # First per repo and time, then only where lang changes.
+        sorted_times = time[order]
+        starts[1:] |= sorted_times[1:] != sorted_times[:-1]
+        order = order[starts]
+        sorted_repos = repo_codes[order]
+        sorted_langs = lang_codes[order]
+        keeps = np.ones(len(order), dtype=bool)
+        keeps[1:] = (sorted_repos[1:] != sorted_repos[:-1]) | (
+            sorted_langs[1:] != sorted_langs[:-1]
+        )
+        winners = order[keeps]
+        kept = langs.iloc[winners]
+        times = kept["time"].to_numpy()
+        kept = kept.assign(year=times // 4, quarter=times % 4 + 1)
+    else:
+        winners = np.sort(order[starts])
+        kept = langs.iloc[winners]
+    kept = kept.drop(columns=["source", "time"]).reset_index(drop=True)
+    # Distinct repo and lang pairs, counted per repo, find the conflicts.
+    pairs = np.unique(
+        repo_codes.astype(np.int64) * (len(lang_names) + 1) + lang_codes + 1
+    )
+    lang_counts = np.bincount(pairs // (len(lang_names) + 1), minlength=len(repo_names))
+    conflicted = lang_counts > 1
+    conflicts = langs[conflicted[repo_codes]].drop(columns=["source", "time"])
+    conflicts = conflicts.sort_values(by=["repo", "lang"])
+    stats: Stats = {
+        "conflicted": int(conflicted.sum()),
+        "repos": len(repo_names),
+        "rows": len(langs),
+        "wins": np.bincount(source[winners], minlength=len(sources)).tolist(),
+    }
+    return Resolution(conflicts=conflicts, langs=kept, stats=stats)
@@ -0,0 +1,166 @@
+import bisect
+import contextlib
+import json
+import os
+import pathlib as pth
+import resource
+import sys
+import threading
+import time
+import typing as typ
+
+# Metrics go out as json lines only when this names a file, or "-" for stderr.
+metrics_var = "LANGUISH_METRICS"
+# And this names a dir for a cProfile dump of each script run.
+profile_var = "LANGUISH_PROFILE"
+
+# Upper bounds in seconds, doubling from a millisecond to about 9 minutes.
+bucket_bounds = [0.001 * 2**index for index in range(20)]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(bucket_bounds) + 1)
+        self.max = 0.0
+        self.total = 0.0
+
+    def add(self, value: float):
+        self.counts[bisect.bisect_left(bucket_bounds, value)] += 1
+        self.max = max(self.max, value)
+        self.total += value
+
+    def quantile(self, fraction: float) -> float:
+        """Approximates as the upper bound of the bucket holding the quantile."""
+        goal = fraction * sum(self.counts)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= goal:
+                bound = bucket_bounds[index] if index < len(bucket_bounds) else self.max
+                return min(self.max, bound)
+        return self.max
+
+    def summary(self) -> dict[str, typ.Any]:
+        count = sum(self.counts)
+        return {
+            "count": count,
+            "max": self.max,
+            "mean": self.total / count if count else 0.0,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Stage:
+    """Collects counts to go out with a stage's timing."""
+
+    def __init__(self):
+        self.counts: dict[str, int | float] = {}
+
+    def count(self, name: str, value: int | float):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+
+histograms: dict[str, Histogram] = {}
+lock = threading.Lock()
+script = pth.Path(sys.argv[0]).stem
+
+
+def count(name: str, value: int | float | None = None, **fields: typ.Any):
+    """Records a one-off value, like rows read or cache hits."""
+    if value is not None:
+        fields["value"] = value
+    emit("count", name=name, **fields)
+
+
+def emit(kind: str, **fields: typ.Any):
+    name = os.environ.get(metrics_var)
+    if not name:
+        return
+    record = {"kind": kind, "script": script, "time": time.time(), **fields}
+    line = json.dumps(record, default=str) + "\n"
+    with lock:
+        if name == "-":
+            sys.stderr.write(line)
+        else:
+            with open(name, "a") as output:
+                output.write(line)
+
+
+def enabled() -> bool:
+    return bool(os.environ.get(metrics_var))
+
+
+def flush():
+    """Emits summaries of everything observed so far, then forgets them."""
+    with lock:
+        items = list(histograms.items())
+        histograms.clear()
+    for name, histogram in items:
+        emit("histogram", name=name, **histogram.summary())
+
+
+def observe(name: str, seconds: float):
+    """Adds to a latency histogram, summarized at flush."""
+    if not enabled():
+        return
+    with lock:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        histogram.add(seconds)
+
+
+def peak_rss_mb() -> float:
+    # Linux ru_maxrss can include the parent's memory from before exec.
+    status = pth.Path("/proc/self/status")
+    if status.exists():
+        for line in status.read_text().splitlines():
+            if line.startswith("VmHWM"):
+                return int(line.split()[1]) / 1024
+    scale = 1 << 20 if sys.platform == "darwin" else 1 << 10
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def run(main: typ.Callable[[], typ.Any]):
+    """Runs a script's main as a stage, with profiling if asked for."""
+    profile_dir = os.environ.get(profile_var)
+    profiler = None
+    if profile_dir:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        with stage("main"):
+            main()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            pth.Path(profile_dir).mkdir(exist_ok=True, parents=True)
+            profiler.dump_stats(pth.Path(profile_dir) / f"{script}.prof")
+        flush()
+
+
+@contextlib.contextmanager
+def stage(name: str) -> typ.Iterator[Stage]:
+    """Times a block, emitting its counts and memory high-water mark after."""
+    info = Stage()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield info
+    except BaseException as err:
+        error = type(err).__name__
+        raise
+    finally:
+        if enabled():
+            emit(
+                "stage",
+                counts=info.counts,
+                error=error,
+                name=name,
+                peak_rss_mb=peak_rss_mb(),
+                seconds=time.perf_counter() - start,
+            )
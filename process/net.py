@@ -0,0 +1,40 @@
+import requests
+import requests.adapters
+import threading
+import time
+
+
+class TokenBucket:
+    """Blocks callers to hold a request rate, allowing short bursts."""
+
+    def __init__(self, *, rate: float, burst: float | None = None):
+        self.capacity = burst if burst is not None else max(1.0, rate / 10)
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            # Go into debt if needed, and wait it out outside the lock.
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if delay:
+            time.sleep(delay)
+
+
+def init_session(
+    *, headers: dict[str, str] | None = None, pool_size: int = 10
+) -> requests.Session:
+    """Makes a session whose one connection pool serves all worker threads."""
+    session = requests.Session()
+    session.headers.update(headers or {})
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
@@ -0,0 +1,114 @@
+import frames
+import hashlib
+import json
+import pandas as pd
+import pathlib as pth
+import typing as typ
+
+
+class Stamp(typ.TypedDict):
+    mtime: int
+    name: str
+    sha256: str
+    size: int
+
+
+class Entry(typ.TypedDict):
+    deps: list[Stamp]
+    path: str
+
+
+class PartitionCache:
+    """Materialized partial results, reused while their inputs are unchanged.
+
+    Inputs count as unchanged if size and mtime match, or failing that, if
+    their content hash does, so touched or recopied files still hit.
+    """
+
+    def __init__(self, dir: str | pth.Path):
+        self.dir = pth.Path(dir)
+        self.dir.mkdir(exist_ok=True, parents=True)
+        self.manifest_path = self.dir / "manifest.json"
+        self.manifest: dict[str, Entry] = {}
+        if self.manifest_path.exists():
+            self.manifest = json.loads(self.manifest_path.read_text())
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, key: str, *, deps: list[str]) -> pd.DataFrame | None:
+        entry = self.manifest.get(key)
+        path = entry and self.dir / entry["path"]
+        if entry and path.exists() and self.match(entry, deps=deps):
+            self.hits += 1
+            return frames.read_frame(path)
+        self.misses += 1
+        return None
+
+    def match(self, entry: Entry, *, deps: list[str]) -> bool:
+        stamps = match_stamps(entry["deps"], deps)
+        if stamps is None:
+            return False
+        if stamps != entry["deps"]:
+            # Save fresh mtimes so we skip hashing next time.
+            entry["deps"] = stamps
+            self.save()
+        return True
+
+    def save(self):
+        temp = self.manifest_path.with_suffix(".tmp")
+        temp.write_text(json.dumps(self.manifest, indent=2))
+        temp.replace(self.manifest_path)
+
+    def store(self, key: str, frame: pd.DataFrame, *, deps: list[str]):
+        name = hashlib.sha256(key.encode()).hexdigest()[:16] + default_suffix()
+        frames.write_frame(frame, self.dir / name)
+        self.manifest[key] = {
+            "deps": [stamp(pth.Path(dep)) for dep in deps],
+            "path": name,
+        }
+        self.save()
+
+
+def default_suffix() -> str:
+    try:
+        import pyarrow
+    except ImportError:
+        return ".csv"
+    return ".parquet"
+
+
+def hash_file(path: pth.Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as input:
+        while block := input.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def match_stamps(olds: list[Stamp], names: list[str]) -> list[Stamp] | None:
+    """Gives current stamps if the files are unchanged, or else None."""
+    if len(olds) != len(names):
+        return None
+    stamps = []
+    for old, name in zip(olds, names):
+        path = pth.Path(name)
+        if old["name"] != str(path.resolve()) or not path.exists():
+            return None
+        stat = path.stat()
+        if (old["size"], old["mtime"]) == (stat.st_size, stat.st_mtime_ns):
+            stamps.append(old)
+        elif old["size"] == stat.st_size and old["sha256"] == hash_file(path):
+            stamps.append(stamp(path))
+        else:
+            return None
+    return stamps
+
+
+def stamp(path: pth.Path) -> Stamp:
+    stat = path.stat()
+    return {
+        "mtime": stat.st_mtime_ns,
+        "name": str(path.resolve()),
+        "sha256": hash_file(path),
+        "size": stat.st_size,
+    }
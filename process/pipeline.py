@@ -0,0 +1,455 @@
+import argparse
+import assemble
+import concurrent.futures as cf
+import contextlib
+import frames
+import gh_merge_events
+import gh_to_json
+import gharchive
+import ghmerge
+import ghquery
+import glob
+import json
+import langmerge
+import metrics
+import partitions
+import pathlib as pth
+import query
+import so_process
+import traceback
+import typing as typ
+import wp_query
+
+
+class Args(typ.TypedDict):
+    archive: list[str] | None
+    data: str
+    dry_run: bool
+    fetch: bool
+    force: bool
+    jobs: int
+    keys: str
+    memo: bool
+    names: str
+    outdir: str
+    stages: list[str] | None
+    work: str
+    workers: int | None
+
+
+class Stage(typ.NamedTuple):
+    """One script run, with what it reads and writes for ordering and skips.
+
+    Inputs are file globs, fingerprinted to skip reruns on unchanged data.
+    Fetch stages hit the network, so they only run when asked for.
+    Replaced outputs get removed first, since scripts refuse to overwrite.
+    """
+
+    args: dict[str, typ.Any]
+    fetch: bool
+    inputs: list[str]
+    name: str
+    outputs: list[str]
+    replaces: list[str]
+    run: typ.Callable[[dict[str, typ.Any]], typ.Any]
+
+
+manifest_name = "pipeline.json"
+
+
+def dependencies(stages: list[Stage]) -> dict[str, set[str]]:
+    """Finds which stages produce what each stage reads."""
+    deps: dict[str, set[str]] = {stage.name: set() for stage in stages}
+    for stage in stages:
+        for other in stages:
+            if other is stage:
+                continue
+            for input in stage.inputs:
+                if any(
+                    input == output or input.startswith(f"{output}/")
+                    for output in other.outputs
+                ):
+                    deps[stage.name].add(other.name)
+    return deps
+
+
+def fingerprint(stage: Stage) -> tuple[str, list[str]]:
+    names = sorted(
+        name
+        for input in stage.inputs
+        for name in glob.glob(input)
+        if pth.Path(name).is_file()
+    )
+    return json.dumps(stage.args, sort_keys=True, default=str), names
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--archive",
+        help="local GH Archive files or globs to use instead of the events query",
+        nargs="+",
+    )
+    parser.add_argument("--data", default="../src/data.json", help="site data file")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--fetch", action="store_true", help="also run fetch stages")
+    parser.add_argument("--force", action="store_true", help="ignore fingerprints")
+    parser.add_argument("--jobs", default=3, type=int, help="stages at once")
+    parser.add_argument("--keys", default="../scripts/data/keys.csv")
+    parser.add_argument(
+        "--no-memo",
+        action="store_false",
+        dest="memo",
+        help="read frames back from disk between stages",
+    )
+    parser.add_argument("--names", default="../scripts/data/canonical-names.json")
+    parser.add_argument("--outdir", default="../scripts/data")
+    parser.add_argument("--stages", nargs="+", help="just these and what they need")
+    parser.add_argument("--work", required=True, help="dir for intermediate files")
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args().__dict__
+    run(args=args)
+
+
+def plan(args: Args) -> list[Stage]:
+    """Lays out the GitHub, Stack Overflow, and Wikipedia branches."""
+    work = pth.Path(args["work"])
+    outdir = pth.Path(args["outdir"])
+    # Fetches stay csv so they can resume, but the rest can be columnar.
+    suffix = partitions.default_suffix()
+    paths = {
+        "bq_langs": str(work / "gh-langs-bq.csv"),
+        "chunks": str(work / "chunks"),
+        "contras": str(work / "contras.csv"),
+        "events": str(work / "gh-events.csv"),
+        "gh_langs": str(work / f"gh-langs-graphql{suffix}"),
+        "lang_events": str(work / f"gh-lang-events{suffix}"),
+        "langs": str(work / f"langs{suffix}"),
+        "so": str(work / "so.csv"),
+    }
+    partitions_dir = str(work / "partitions")
+    workers = args["workers"]
+    gh_json = [str(outdir / f"{name}.json") for name in gh_file_names()]
+    so_json = [str(outdir / "so-tags.json")]
+    if args["archive"]:
+        events = Stage(
+            args={
+                "events": gharchive.default_events,
+                "inputs": args["archive"],
+                "min_count": 10,
+                "output": paths["events"],
+                "partitions": 16,
+                "workers": workers,
+            },
+            fetch=False,
+            inputs=args["archive"],
+            name="gharchive",
+            outputs=[paths["events"]],
+            replaces=[paths["events"]],
+            run=lambda args: gharchive.run(args=args),
+        )
+    else:
+        events = Stage(
+            args={"output": paths["events"], "page_size": 100_000, "query": "ghEvents"},
+            fetch=True,
+            inputs=[],
+            name="gh_events_query",
+            outputs=[paths["events"]],
+            replaces=[],
+            run=lambda args: query.run(args=args),
+        )
+    return [
+        events,
+        Stage(
+            args={"output": paths["bq_langs"], "page_size": 100_000, "query": "gh"},
+            fetch=True,
+            inputs=[],
+            name="gh_langs_query",
+            outputs=[paths["bq_langs"]],
+            replaces=[],
+            run=lambda args: query.run(args=args),
+        ),
+        Stage(
+            args={"output": paths["so"], "page_size": 100_000, "query": "so"},
+            fetch=True,
+            inputs=[],
+            name="so_query",
+            outputs=[paths["so"]],
+            replaces=[],
+            run=lambda args: query.run(args=args),
+        ),
+        Stage(
+            args={
+                "batch_rows": 1_000_000,
+                "batch_size": 100,
+                # Stages run at once, so each gets its own cache to write.
+                "cache": str(work / "ghquery-http.sqlite"),
+                "cache_ttl": None,
+                "dones": None,
+                "endpoint": ghquery.endpoint,
+                "events": [paths["events"]],
+                "format": "segments",
+                "min_count": None,
+                "offline": False,
+                "outdir": paths["chunks"],
+                "retries": 5,
+                "sketch_width": None,
+                "target_seconds": 10.0,
+                "workers": workers or 4,
+            },
+            fetch=True,
+            inputs=[paths["events"]],
+            name="ghquery",
+            outputs=[paths["chunks"]],
+            replaces=[],
+            run=lambda args: ghquery.run(args=args),
+        ),
+        Stage(
+            args={
+                "jsondir": paths["chunks"],
+                "output": paths["gh_langs"],
+                "workers": workers,
+            },
+            fetch=False,
+            inputs=[
+                f"{paths['chunks']}/chunk*.json",
+                f"{paths['chunks']}/segment*.bin",
+            ],
+            name="ghmerge",
+            outputs=[paths["gh_langs"], paths["contras"]],
+            replaces=[paths["gh_langs"]],
+            run=lambda args: ghmerge.run(args=args),
+        ),
+        Stage(
+            args={
+                "drops": ["empty", "multi"],
+                # Oldest first, as the snapshot predates the live queries.
+                "inputs": [paths["bq_langs"], paths["gh_langs"]],
+                "output": paths["langs"],
+                "policy": "first",
+                "since": None,
+            },
+            fetch=False,
+            inputs=[paths["bq_langs"], paths["gh_langs"]],
+            name="langmerge",
+            outputs=[paths["langs"]],
+            replaces=[paths["langs"]],
+            run=lambda args: langmerge.run(args=args),
+        ),
+        Stage(
+            args={
+                "batch_rows": 1_000_000,
+                "cache": partitions_dir,
+                "events": [paths["events"]],
+                "langs": paths["langs"],
+                "output": paths["lang_events"],
+                "workers": workers,
+            },
+            fetch=False,
+            inputs=[paths["events"], paths["langs"]],
+            name="gh_merge_events",
+            outputs=[paths["lang_events"]],
+            replaces=[paths["lang_events"]],
+            run=lambda args: gh_merge_events.run(args=args),
+        ),
+        Stage(
+            args={
+                "csv": paths["lang_events"],
+                "outdir": str(outdir),
+                "splice": True,
+            },
+            fetch=False,
+            inputs=[paths["lang_events"]],
+            name="gh_to_json",
+            outputs=gh_json,
+            replaces=[],
+            run=lambda args: gh_to_json.run(args=args),
+        ),
+        Stage(
+            args={
+                "cache": partitions_dir,
+                "keys": args["keys"],
+                "outdir": str(outdir),
+                "so": [paths["so"]],
+                "splice": True,
+                "workers": workers,
+            },
+            fetch=False,
+            inputs=[paths["so"], args["keys"]],
+            name="so_process",
+            outputs=so_json,
+            replaces=[],
+            run=lambda args: so_process.run(args),
+        ),
+        Stage(
+            args={
+                "datadir": str(outdir),
+                "fractions": False,
+                "keys": args["keys"],
+                "names": args["names"],
+                "output": args["data"],
+            },
+            fetch=False,
+            inputs=[*gh_json, *so_json, args["keys"], args["names"]],
+            name="assemble",
+            outputs=[args["data"]],
+            replaces=[],
+            run=lambda args: assemble.run(args=args),
+        ),
+        Stage(
+            args={
+                "cache": str(work / "wp-http.sqlite"),
+                "cache_ttl": None,
+                "end": None,
+                "keys": args["keys"],
+                "offline": False,
+                "output": str(work),
+                "rate": 100,
+                "workers": workers or 16,
+            },
+            fetch=True,
+            inputs=[args["keys"]],
+            name="wp_query",
+            outputs=[str(work / "wikipedia")],
+            replaces=[],
+            run=lambda args: wp_query.run(argparse.Namespace(**args)),
+        ),
+    ]
+
+
+def fresh_entry(
+    stage: Stage, *, manifest: dict[str, typ.Any]
+) -> dict[str, typ.Any] | None:
+    """Gives a refreshed entry if the stage ran before on the same inputs."""
+    entry = manifest.get(stage.name)
+    if stage.fetch or entry is None:
+        # Fetches depend on the world, so only their own resume logic applies.
+        return None
+    if not all(pth.Path(output).exists() for output in stage.outputs):
+        return None
+    key, names = fingerprint(stage)
+    if entry["args"] != key:
+        return None
+    stamps = partitions.match_stamps(entry["deps"], names)
+    if stamps is None:
+        return None
+    return {"args": key, "deps": stamps}
+
+
+def gh_file_names() -> list[str]:
+    return ["gh-issue-event", "gh-pull-request", "gh-star-event"]
+
+
+def run(*, args: Args):
+    work = pth.Path(args["work"])
+    work.mkdir(exist_ok=True, parents=True)
+    pth.Path(args["outdir"]).mkdir(exist_ok=True, parents=True)
+    stages = plan(args)
+    deps = dependencies(stages)
+    chosen = select(stages, deps=deps, names=args["stages"])
+    if not args["fetch"]:
+        chosen = [stage for stage in chosen if not stage.fetch]
+    by_name = {stage.name: stage for stage in chosen}
+    manifest_path = work / manifest_name
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    if args["dry_run"]:
+        for stage in chosen:
+            fresh = fresh_entry(stage, manifest=manifest) is not None
+            state = "fresh" if fresh else "stale"
+            print(
+                f"{stage.name}: {state}, after {sorted(deps[stage.name] & set(by_name))}"
+            )
+        return
+    done: set[str] = set()
+    failed: set[str] = set()
+    # Which stages still read each path, so memo can drop what's finished.
+    readers = {stage.name: set(stage.inputs) for stage in chosen}
+    memo = frames.remembering() if args["memo"] else contextlib.nullcontext()
+    with memo, cf.ThreadPoolExecutor(max_workers=args["jobs"]) as executor:
+        pending: dict[cf.Future, Stage] = {}
+        while len(done) + len(failed) < len(chosen):
+            for stage in chosen:
+                names = deps[stage.name] & set(by_name)
+                started = stage.name in done or stage.name in failed
+                if started or stage in pending.values():
+                    continue
+                if names & failed:
+                    print(
+                        f"{stage.name}: skipped after failed {sorted(names & failed)}"
+                    )
+                    failed.add(stage.name)
+                elif names <= done:
+                    pending[
+                        executor.submit(run_stage, stage, args=args, manifest=manifest)
+                    ] = stage
+            if not pending:
+                continue
+            finished, _ = cf.wait(pending, return_when=cf.FIRST_COMPLETED)
+            for future in finished:
+                stage = pending.pop(future)
+                try:
+                    manifest[stage.name] = future.result()
+                except Exception:
+                    traceback.print_exc()
+                    print(f"{stage.name}: failed")
+                    failed.add(stage.name)
+                    continue
+                done.add(stage.name)
+                # Only this thread touches the manifest, so no races.
+                save_manifest(manifest_path, manifest)
+                del readers[stage.name]
+                still_read = set().union(*readers.values())
+                for other in chosen:
+                    if other.name in done:
+                        for output in other.outputs:
+                            if output not in still_read:
+                                frames.forget(output)
+    print(f"done: {len(done)}, failed: {len(failed)}")
+    if failed:
+        raise SystemExit(1)
+
+
+def run_stage(
+    stage: Stage, *, args: Args, manifest: dict[str, typ.Any]
+) -> dict[str, typ.Any]:
+    """Runs a stage unless fresh, giving its new manifest entry either way."""
+    if not args["force"]:
+        entry = fresh_entry(stage, manifest=manifest)
+        if entry is not None:
+            print(f"{stage.name}: unchanged, skipping")
+            return entry
+    print(f"{stage.name}: running")
+    for name in stage.replaces:
+        pth.Path(name).unlink(missing_ok=True)
+    with metrics.stage(stage.name):
+        stage.run(stage.args)
+    key, names = fingerprint(stage)
+    return {"args": key, "deps": [partitions.stamp(pth.Path(name)) for name in names]}
+
+
+def save_manifest(path: pth.Path, manifest: dict[str, typ.Any]):
+    temp = path.with_suffix(".tmp")
+    temp.write_text(json.dumps(manifest, indent=2))
+    temp.replace(path)
+
+
+def select(
+    stages: list[Stage], *, deps: dict[str, set[str]], names: list[str] | None
+) -> list[Stage]:
+    """Gives the named stages plus everything upstream, in plan order."""
+    if not names:
+        return stages
+    known = {stage.name for stage in stages}
+    assert set(names) <= known, f"unknown stages: {sorted(set(names) - known)}"
+    wanted = set(names)
+    frontier = list(names)
+    while frontier:
+        for dep in deps[frontier.pop()]:
+            if dep not in wanted:
+                wanted.add(dep)
+                frontier.append(dep)
+    return [stage for stage in stages if stage.name in wanted]
+
+
+if __name__ == "__main__":
+    metrics.run(main)
@@ -1,7 +1,9 @@
 import csv
+import metrics
 from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Iterator, TextIO
+from splits import Span, iter_lines, read_header, split_spans
+from typing import Iterable, Iterator, TextIO
 
 
 @dataclass(frozen=True, order=True)
@@ -25,14 +27,58 @@ def combos_iter(*, keys_name: str, so_name: str) -> Iterator[tuple[ComboKey, int
                 yield combo, count
 
 
+def count_combos(
+    *, keys_name: str, so_name: str, span: Span | None = None
+) -> dict[int, int]:
+    """Sums counts by packed name, year, and quarter, as from pack_combo.
+
+    Same results as combos_iter but without per-hit allocations, and with
+    each distinct tags string resolved to name indices only once.
+    """
+    keys = read_keys(keys_name)
+    names = {name: index for index, name in enumerate(sorted(set(keys.values())))}
+    tag_names = {tag: names[name] for tag, name in keys.items()}
+    tags_names: dict[str, tuple[int, ...]] = {}
+    whens: dict[tuple[str, str], int] = {}
+    counts: dict[int, int] = {}
+    get_count = counts.get
+    with open_span(so_name, span) as so_in:
+        reader = csv.reader(so_in)
+        header = next(reader)
+        tags_at, year_at, quarter_at, count_at = [
+            header.index(field) for field in ["tags", "year", "quarter", "count"]
+        ]
+        for row in reader:
+            tags = row[tags_at]
+            found = tags_names.get(tags)
+            if found is None:
+                found = tuple(
+                    {tag_names[tag] for tag in tags.split("|") if tag in tag_names}
+                )
+                tags_names[tags] = found
+            if not found:
+                continue
+            year_quarter = row[year_at], row[quarter_at]
+            when = whens.get(year_quarter)
+            if when is None:
+                when = pack_combo(0, int(year_quarter[0]), int(year_quarter[1]))
+                whens[year_quarter] = when
+            count = int(row[count_at])
+            for name in found:
+                combo = name << 18 | when
+                counts[combo] = get_count(combo, 0) + count
+    return counts
+
+
 def main():
     from argparse import ArgumentParser
 
     parser = ArgumentParser()
+    parser.add_argument("--jobs", default=1, type=int)
     parser.add_argument("--keys", required=True)
     parser.add_argument("--so", nargs="+", required=True)
     args = parser.parse_args()
-    run(keys_name=args.keys, so_names=args.so)
+    run(jobs=args.jobs, keys_name=args.keys, so_names=args.so)
 
 
 @contextmanager
@@ -46,6 +92,23 @@ def open_or_stdin(name: str) -> Iterator[TextIO]:
             yield io
 
 
+@contextmanager
+def open_span(name: str, span: Span | None) -> Iterator[Iterable[str]]:
+    """Opens a whole file or just the header line and a byte span."""
+    from itertools import chain
+
+    if span is None:
+        with open_or_stdin(name) as io:
+            yield io
+    else:
+        yield chain([read_header(name)], iter_lines(name, span))
+
+
+def pack_combo(name: int, year: int, quarter: int) -> int:
+    """Packs a name index, year, and quarter into one sortable int."""
+    return (name << 16 | year) << 2 | quarter - 1
+
+
 def read_keys(keys_name: str) -> dict[str, str]:
     from csv import DictReader
 
@@ -57,21 +120,52 @@ def read_keys(keys_name: str) -> dict[str, str]:
     return keys
 
 
-def run(*, keys_name: str, so_names: list[str]):
-    from collections import defaultdict
+def run(*, jobs: int = 1, keys_name: str, so_names: list[str]):
     from json import dumps
 
-    counts: dict[ComboKey, int] = defaultdict(int)
-    for so_name in so_names:
-        for combo, count in combos_iter(keys_name=keys_name, so_name=so_name):
-            counts[combo] += count
+    counts = sum_combos(jobs=jobs, keys_name=keys_name, so_names=so_names)
+    metrics.count("combos", len(counts))
+    names = sorted(set(read_keys(keys_name).values()))
     rows = []
+    # Names are indexed in sorted order, so packed keys sort like ComboKey.
     for combo, count in sorted(counts.items()):
-        row = combo.__dict__.copy()
-        row.update(count=count)
-        rows.append(row)
+        name, year, quarter = unpack_combo(combo)
+        rows.append(dict(name=names[name], year=year, quarter=quarter, count=count))
     print(dumps(rows, indent=2))
 
 
+def sum_combos(*, jobs: int, keys_name: str, so_names: list[str]) -> dict[int, int]:
+    from concurrent.futures import ProcessPoolExecutor
+
+    if jobs > 1 and "-" not in so_names:
+        # Split big files too, since rows are independent until the sum.
+        tasks = [
+            (so_name, span)
+            for so_name in so_names
+            for span in split_spans(so_name, parts=jobs)
+        ]
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(
+                    count_combos, keys_name=keys_name, so_name=so_name, span=span
+                )
+                for so_name, span in tasks
+            ]
+            parts = [future.result() for future in futures]
+    else:
+        parts = [
+            count_combos(keys_name=keys_name, so_name=so_name) for so_name in so_names
+        ]
+    counts = parts[0] if parts else {}
+    for part in parts[1:]:
+        for combo, value in part.items():
+            counts[combo] = counts.get(combo, 0) + value
+    return counts
+
+
+def unpack_combo(combo: int) -> tuple[int, int, int]:
+    return combo >> 18, combo >> 2 & 0xFFFF, (combo & 3) + 1
+
+
 if __name__ == "__main__":
-    main()
+    metrics.run(main)
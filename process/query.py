@@ -1,15 +1,64 @@
 import argparse
 import csv
+import frames
+import json
+import metrics
+import os
 import pathlib as pth
+import time
 import typing as typ
-from google.cloud import bigquery
 
 
 class Args(typ.TypedDict):
+    page_size: int
     query: typ.Literal["gh", "ghEvents", "so"]
     output: str
 
 
+class ExportState(typ.TypedDict):
+    """Saved beside partial csv output, so exports can resume."""
+
+    bytes: int
+    rows: int
+    table: str
+
+
+class Rows(typ.Protocol):
+    """The parts of BigQuery's RowIterator we use, easy to fake locally."""
+
+    pages: typ.Iterable[typ.Iterable[typ.Any]]
+
+    def to_arrow_iterable(self) -> typ.Iterable[typ.Any]: ...
+
+
+class Progress:
+    def __init__(self, *, rows: int = 0, bytes: int = 0, every: float = 5.0):
+        self.bytes = bytes
+        self.every = every
+        self.rows = rows
+        self.start = self.last = self.page = time.monotonic()
+        self.start_rows = rows
+
+    def report(self, *, force: bool = False):
+        now = time.monotonic()
+        if force or now - self.last >= self.every:
+            self.last = now
+            rate = (self.rows - self.start_rows) / max(now - self.start, 1e-9)
+            mb = self.bytes / 1e6
+            print(f"rows: {self.rows}, {rate:.0f} rows/s, {mb:.1f} MB", flush=True)
+        if force:
+            metrics.count("exported", bytes=self.bytes, rows=self.rows)
+
+    def update(self, *, rows: int, bytes: int):
+        # Time per page covers both fetching and writing it.
+        now = time.monotonic()
+        metrics.observe("page_seconds", now - self.page)
+        self.page = now
+        self.rows += rows
+        self.bytes = bytes
+        self.report()
+
+
 queries = {
     # This query will process 194.51 MB when run.
     "gh": """
@@ -80,33 +129,95 @@ queries = {
 }
 
 
+def export_arrow(rows: Rows, *, output: pth.Path):
+    """Writes record batches to Parquet or Arrow IPC as they arrive."""
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    progress = Progress()
+    writer = None
+    try:
+        for batch in rows.to_arrow_iterable():
+            if writer is None:
+                if frames.format_of(output) == "parquet":
+                    writer = pyarrow.parquet.ParquetWriter(output, batch.schema)
+                else:
+                    writer = pyarrow.ipc.new_file(output, batch.schema)
+            writer.write_batch(batch)
+            progress.update(rows=batch.num_rows, bytes=os.path.getsize(output))
+    finally:
+        if writer is not None:
+            writer.close()
+    progress.report(force=True)
+
+
+def export_csv(
+    rows: Rows, *, output: pth.Path, state: ExportState, state_path: pth.Path
+):
+    """Appends pages as they arrive, saving state after each for resuming."""
+    if state["bytes"]:
+        # Drop anything written after the last saved page.
+        os.truncate(output, state["bytes"])
+    save_state(state_path, state)
+    progress = Progress(rows=state["rows"], bytes=state["bytes"])
+    with open(output, "a", newline="") as out_stream:
+        writer = csv.writer(out_stream)
+        for page in rows.pages:
+            page_rows = list(page)
+            if page_rows and not state["bytes"]:
+                writer.writerow([*page_rows[0].keys()])
+            writer.writerows(row.values() for row in page_rows)
+            out_stream.flush()
+            state["bytes"] = out_stream.tell()
+            state["rows"] += len(page_rows)
+            save_state(state_path, state)
+            progress.update(rows=len(page_rows), bytes=state["bytes"])
+    progress.report(force=True)
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--output", required=True)
-    parser.add_argument(
-        "--query", choices=["gh", "ghEvents", "so"], required=True
-    )
+    parser.add_argument("--page-size", default=100_000, type=int)
+    parser.add_argument("--query", choices=["gh", "ghEvents", "so"], required=True)
     args = parser.parse_args().__dict__
     run(args=args)
 
 
 def run(*, args: Args):
+    from google.cloud import bigquery
+
     client = bigquery.Client()
     output = pth.Path(args["output"])
     output.parent.mkdir(exist_ok=True, parents=True)
-    assert not output.exists()
-    query_job = client.query(queries[args["query"]])
+    state_path = output.with_name(f"{output.name}.export.json")
+    page_size = args["page_size"]
+    if output.exists():
+        # Pick up from the query's destination table, which BigQuery keeps
+        # for about a day.
+        assert state_path.exists(), f"output exists: {output}"
+        state: ExportState = json.loads(state_path.read_text())
+        print(f"resuming from row {state['rows']} of {state['table']}")
+        table = client.get_table(state["table"])
+        rows = client.list_rows(table, page_size=page_size, start_index=state["rows"])
+    else:
+        query_job = client.query(queries[args["query"]])
+        rows = query_job.result(page_size=page_size)
+        state = {"bytes": 0, "rows": 0, "table": str(query_job.destination)}
     # Only bother to open output after query started working.
-    with open(args["output"], "w") as out_stream:
-        writer = csv.writer(out_stream)
-        keys: list[str] | None = None
-        for row in query_job:
-            if keys is None:
-                keys = [*row.keys()]
-                writer.writerow(keys)
-            values = [row[key] for key in keys]
-            writer.writerow(values)
+    if frames.format_of(output) == "csv":
+        export_csv(rows, output=output, state=state, state_path=state_path)
+    else:
+        assert not state["rows"], "only csv exports can resume"
+        export_arrow(rows, output=output)
+    state_path.unlink(missing_ok=True)
+
+
+def save_state(path: pth.Path, state: ExportState):
+    temp = path.with_suffix(".tmp")
+    temp.write_text(json.dumps(state))
+    temp.replace(path)
 
 
 if __name__ == "__main__":
-    main()
+    metrics.run(main)
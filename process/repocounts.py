@@ -0,0 +1,120 @@
+import frames
+import numpy as np
+import pandas as pd
+import repos
+import typing as typ
+
+
+class RepoCounts(typ.NamedTuple):
+    counts: pd.DataFrame
+    events: int
+
+
+class Sketch:
+    """Count-min sketch, which can overcount a repo but never undercount it."""
+
+    def __init__(self, *, depth: int = 4, width: int):
+        self.counts = np.zeros((depth, width), dtype=np.int64)
+        self.width = width
+
+    def add(self, names: pd.Index, counts: np.ndarray):
+        for row, cells in enumerate(self.cells(names)):
+            np.add.at(self.counts[row], cells, counts)
+
+    def cells(self, names: pd.Index) -> list[np.ndarray]:
+        values = np.asarray(names, dtype=object)
+        # Each row gets its own hash by its own key.
+        return [
+            pd.util.hash_array(values, hash_key=f"repocounts{row:06}")
+            % np.uint64(self.width)
+            for row in range(len(self.counts))
+        ]
+
+    def estimate(self, names: pd.Index) -> np.ndarray:
+        estimates = [
+            self.counts[row][cells] for row, cells in enumerate(self.cells(names))
+        ]
+        return np.min(estimates, axis=0)
+
+
+class Totals:
+    """Exact sums by repo, kept as a log of batch sums compacted as it grows.
+
+    Compacting only once pending sums outgrow the totals keeps the work per
+    row constant and the memory near twice the distinct repos.
+    """
+
+    def __init__(self, *, min_compact: int = 1_000_000):
+        self.min_compact = min_compact
+        self.pending: list[pd.Series] = []
+        self.pending_rows = 0
+        self.totals = pd.Series(dtype=np.int64)
+
+    def add(self, sums: pd.Series):
+        self.pending.append(sums)
+        self.pending_rows += len(sums)
+        if self.pending_rows > max(self.min_compact, len(self.totals)):
+            self.compact()
+
+    def compact(self):
+        if self.pending:
+            merged = pd.concat([self.totals, *self.pending])
+            self.totals = merged.groupby(level=0, sort=False).sum()
+            self.pending = []
+            self.pending_rows = 0
+
+    def frame(self) -> pd.DataFrame:
+        self.compact()
+        counts = self.totals.rename_axis("repo").rename("count")
+        return counts.astype(np.int64).reset_index()
+
+
+def batch_sums(batch: pd.DataFrame) -> pd.Series:
+    """Sums a batch by canonical repo name, dropping invalid names."""
+    batch = batch.assign(repo=repos.normalize(batch["repo"]))
+    sums = batch.groupby("repo", observed=True)["count"].sum()
+    return pd.Series(
+        sums.to_numpy(dtype=np.int64), index=np.asarray(sums.index, dtype=object)
+    )
+
+
+def count_repos(
+    names: list[str],
+    *,
+    batch_rows: int = 1_000_000,
+    min_count: int | None = None,
+    sketch_width: int | None = None,
+) -> RepoCounts:
+    """Streams event files into exact count totals by repo.
+
+    Memory goes with distinct repos, not event rows. With a sketch width and
+    a min count, a first pass sketches counts, so the exact second pass only
+    keeps repos that might reach the min, for memory with just the heavy
+    hitters.
+    """
+    sketch = None
+    if sketch_width:
+        assert min_count, "a sketch needs a min count to pick candidates"
+        sketch = Sketch(width=sketch_width)
+        for batch in iter_events(names, batch_rows=batch_rows):
+            sums = batch_sums(batch)
+            sketch.add(sums.index, sums.to_numpy())
+    events = 0
+    totals = Totals()
+    for batch in iter_events(names, batch_rows=batch_rows):
+        events += len(batch)
+        sums = batch_sums(batch)
+        if sketch is not None:
+            sums = sums[sketch.estimate(sums.index) >= min_count]
+        totals.add(sums)
+    counts = totals.frame()
+    if min_count:
+        counts = counts[counts["count"] >= min_count].reset_index(drop=True)
+    return RepoCounts(counts=counts, events=events)
+
+
+def iter_events(names: list[str], *, batch_rows: int) -> typ.Iterator[pd.DataFrame]:
+    for name in names:
+        yield from frames.iter_batches(
+            name, batch_rows=batch_rows, columns=["count", "repo"]
+        )
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import re
+import typing as typ
+
+# Same prefixes the BigQuery events query strips from repo urls, and a bit more.
+url_prefix = r"^(?:https?://)?(?:www\.)?(?:api\.)?github\.com/(?:repos/)?"
+# GitHub allows letters, digits, and "-" in owners, though some old ones
+# have "_", and repo names can also have "." beyond that.
+valid = re.compile(r"[a-z0-9_-][a-z0-9_.-]*/[a-z0-9_.-]+")
+
+
+def canonical(repo: str) -> str | None:
+    """Gives the lowercase owner/name, or None if the text doesn't make one."""
+    repo = re.sub(url_prefix, "", repo.strip(), flags=re.IGNORECASE).lower()
+    repo = repo.rstrip("/").removesuffix(".git")
+    return repo if valid.fullmatch(repo) else None
+
+
+def normalize(
+    repos: pd.Series, *, aliases: typ.Mapping[str, str] | None = None
+) -> pd.Series:
+    """Canonicalizes repos as categorical codes, with None for invalid ones.
+
+    String work happens once per distinct value, so repeated repos are cheap.
+    Aliases map canonical old names to new, as from resolve_aliases.
+    """
+    codes, uniques = pd.factorize(repos)
+    texts = pd.Series(np.asarray(uniques, dtype=object), dtype="string")
+    texts = texts.str.strip().str.replace(url_prefix, "", case=False, regex=True)
+    texts = texts.str.lower().str.rstrip("/").str.removesuffix(".git")
+    texts = texts.where(texts.str.fullmatch(valid.pattern).fillna(False))
+    if aliases:
+        texts = texts.map(aliases.get).fillna(texts)
+    # Distinct raw values can collapse to one canonical name.
+    canon_codes, names = pd.factorize(texts)
+    codes = np.where(codes >= 0, canon_codes[codes], -1)
+    names = pd.Index(np.asarray(names, dtype=object))
+    categories = pd.Categorical.from_codes(codes, categories=names)
+    return pd.Series(categories, index=repos.index, name=repos.name)
+
+
+def resolve_aliases(pairs: typ.Iterable[tuple[str, str]]) -> dict[str, str]:
+    """Canonicalizes old to new pairs and follows chains of renames."""
+    aliases: dict[str, str] = {}
+    for old, new in pairs:
+        old, new = canonical(old), canonical(new)
+        if old and new and old != new:
+            aliases[old] = new
+    for old in list(aliases):
+        new = aliases[old]
+        seen = {old}
+        while new in aliases and new not in seen:
+            seen.add(new)
+            new = aliases[new]
+        aliases[old] = new
+    return aliases
+
+
+def split_owner_name(repos: pd.Series) -> pd.DataFrame:
+    """Splits canonical repos into owner and name columns."""
+    parts = repos.astype("string").str.split("/", n=1, expand=True)
+    parts.columns = ["owner", "name"]
+    return parts
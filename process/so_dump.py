@@ -0,0 +1,98 @@
+import collections
+import html
+import pandas as pd
+import pathlib as pth
+import re
+import shutil
+import splits
+import subprocess
+import typing as typ
+import zipfile
+
+# Posts.xml directly, or inside the 7z from the Stack Exchange data dump.
+suffixes = [".7z", ".xml", ".zip"]
+
+created_pattern = re.compile(rb'\bCreationDate="(\d{4})-(\d{2})')
+question_marker = b'PostTypeId="1"'
+tags_pattern = re.compile(rb'\bTags="([^"]*)"')
+
+
+def is_dump(name: str) -> bool:
+    return pth.Path(name).suffix.lower() in suffixes
+
+
+def iter_dump_lines(name: str) -> typ.Iterator[bytes]:
+    """Streams Posts.xml lines from the file or from inside an archive."""
+    match pth.Path(name).suffix.lower():
+        case ".7z":
+            assert shutil.which("7z"), "reading .7z dumps needs the 7z command"
+            with subprocess.Popen(
+                ["7z", "e", "-so", name], stdout=subprocess.PIPE
+            ) as process:
+                assert process.stdout is not None
+                yield from process.stdout
+            assert process.returncode == 0, f"7z failed on {name}"
+        case ".zip":
+            with zipfile.ZipFile(name) as archive:
+                member = next(
+                    info.filename
+                    for info in archive.infolist()
+                    if info.filename.lower().endswith(".xml")
+                )
+                with archive.open(member) as input:
+                    yield from input
+        case _:
+            with open(name, "rb") as input:
+                yield from input
+
+
+def iter_questions(
+    name: str, *, batch_rows: int = 1_000_000, span: splits.Span | None = None
+) -> typ.Iterator[pd.DataFrame]:
+    """Yields tags, year, quarter, and count, summed over batches of questions.
+
+    Tags come joined by "|", as in the BigQuery export, from either the old
+    "<a><b>" or the newer "|a|b|" form of the dump. Spans only work on plain
+    xml, since the dump gives one row per line.
+    """
+    if span is None:
+        lines = iter_dump_lines(name)
+    else:
+        lines = splits.iter_raw_lines(name, span)
+    counts: collections.Counter[tuple[str, int, int]] = collections.Counter()
+    questions = 0
+    for line in lines:
+        # Most rows are answers, so skip them before any regex.
+        if question_marker not in line:
+            continue
+        question = parse_question(line)
+        if question is None:
+            continue
+        counts[question] += 1
+        questions += 1
+        if questions >= batch_rows:
+            yield to_frame(counts)
+            counts.clear()
+            questions = 0
+    if counts:
+        yield to_frame(counts)
+
+
+def parse_question(line: bytes) -> tuple[str, int, int] | None:
+    created = created_pattern.search(line)
+    tags = tags_pattern.search(line)
+    if created is None or tags is None:
+        return None
+    text = html.unescape(tags.group(1).decode())
+    if text.startswith("<"):
+        text = text[1:-1].replace("><", "|")
+    else:
+        text = text.strip("|")
+    year, month = int(created.group(1)), int(created.group(2))
+    return text, year, (month - 1) // 3 + 1
+
+
+def to_frame(counts: collections.Counter[tuple[str, int, int]]) -> pd.DataFrame:
+    frame = pd.DataFrame(list(counts), columns=["tags", "year", "quarter"])
+    frame["count"] = list(counts.values())
+    return frame
@@ -1,14 +1,29 @@
 import argparse
 from collections import defaultdict
+import concurrent.futures as cf
+import frames
+import metrics
+import multiprocessing
+import numpy as np
 import pandas as pd
+import partitions
 import pathlib as pth
+import so_dump
+import splits
 import typing as typ
 
 
 class Args(typ.TypedDict):
+    cache: str | None
     keys: str
     outdir: str
     so: list[str]
+    splice: bool
+    workers: int | None
+
+
+def cache_key(name: str) -> str:
+    return f"so_process:{pth.Path(name).resolve()}"
 
 
 def drop_obsolete(results, counts):
@@ -23,9 +38,12 @@ def drop_obsolete(results, counts):
 
 def main():
     parser = argparse.ArgumentParser()
+    parser.add_argument("--cache")
     parser.add_argument("--keys", required=True)
     parser.add_argument("--outdir", required=True)
     parser.add_argument("--so", nargs="+", required=True)
+    parser.add_argument("--splice", action="store_true")
+    parser.add_argument("--workers", type=int)
     args = parser.parse_args()
     run(args.__dict__)
 
@@ -38,6 +56,47 @@ def map_tags(keys, counts):
     return counts
 
 
+def read_all(
+    names: list[str], *, args: Args, cache: partitions.PartitionCache | None
+) -> list[pd.DataFrame]:
+    """Reads summed counts by lang name for each file, in the order given.
+
+    Unchanged files come from the cache. With workers, the rest are read in
+    parallel, with big CSVs split into byte spans.
+    """
+    keys_name = args["keys"]
+    results: dict[str, pd.DataFrame] = {}
+    if cache:
+        for name in names:
+            counts = cache.load(cache_key(name), deps=[name, keys_name])
+            if counts is not None:
+                results[name] = counts
+    # A name given twice would otherwise have its spans summed twice.
+    missing = list(dict.fromkeys(name for name in names if name not in results))
+    if args["workers"] and missing:
+        parts: dict[str, list[pd.DataFrame]] = {name: [] for name in missing}
+        with cf.ProcessPoolExecutor(
+            max_workers=args["workers"], mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = {
+                executor.submit(read_part, name, keys_name=keys_name, span=span): name
+                for name in missing
+                for span in spans(name, parts=args["workers"])
+            }
+            for future in cf.as_completed(futures):
+                parts[futures[future]].append(future.result())
+        for name in missing:
+            # Spans of one file are equally authoritative, so just sum.
+            results[name] = sum_counts(pd.concat(parts[name]))
+    else:
+        for name in missing:
+            results[name] = read_part(name, keys_name=keys_name, span=None)
+    if cache:
+        for name in missing:
+            cache.store(cache_key(name), results[name], deps=[name, keys_name])
+    return [results[name] for name in names]
+
+
 def read_keys(name: str) -> dict[str, str]:
     keys = pd.read_csv(name)
     keys["stackoverflow"] = keys["stackoverflow"].str.split("|")
@@ -46,24 +105,79 @@ def read_keys(name: str) -> dict[str, str]:
     return dict(zip(keys["stackoverflow"], keys["key"]))
 
 
-def read_so(name: str) -> pd.DataFrame:
-    counts = pd.read_csv(name)
+def read_part(name: str, *, keys_name: str, span: splits.Span | None) -> pd.DataFrame:
+    return sum_counts(read_so(name, keys=read_keys(keys_name), span=span))
+
+
+def read_so(
+    name: str, *, keys: dict[str, str], span: splits.Span | None = None
+) -> pd.DataFrame:
+    if so_dump.is_dump(name):
+        # Sum by lang a batch at a time, since distinct tag strings add up.
+        parts = [
+            read_so_bigquery(batch, keys=keys)
+            for batch in so_dump.iter_questions(name, span=span)
+        ]
+        if not parts:
+            return pd.DataFrame(columns=["name", "year", "quarter", "count"])
+        return pd.concat(parts, ignore_index=True)
+    if span is None:
+        counts = frames.read_frame(name)
+    else:
+        counts = pd.read_csv(splits.read_span(name, span))
     if "TagName" in counts:
-        return read_so_direct(counts)
+        return map_tags(keys, read_so_direct(counts))
     else:
-        return read_so_bigquery(counts)
-
-
-def read_so_bigquery(counts: pd.DataFrame) -> pd.DataFrame:
-    # Process by year because memory limits.
-    results = []
-    for _, group in counts.groupby(["year", "quarter"]):
-        group["tags"] = group["tags"].str.split("|")
-        sums: pd.DataFrame
-        sums = group.explode("tags").groupby(["year", "quarter", "tags"]).sum()
-        sums.reset_index(inplace=True)
-        results.append(sums)
-    return pd.concat(results)
+        return read_so_bigquery(counts, keys=keys)
+
+
+def read_so_bigquery(
+    counts: pd.DataFrame, *, chunk_rows: int = 1_000_000, keys: dict[str, str]
+) -> pd.DataFrame:
+    """Sums counts for mapped tags into a dense (lang x quarter) grid.
+
+    Only distinct tag strings get split, and only tags in keys are kept, so
+    rows themselves never get exploded.
+    """
+    names = pd.Index(sorted(set(keys.values())))
+    vocab = pd.Series(names.get_indexer(list(keys.values())), index=list(keys))
+    combo_codes, combos = pd.factorize(counts["tags"])
+    tags = pd.Series(combos).str.split("|").explode()
+    pairs = tags.map(vocab).dropna()
+    pair_combos = pairs.index.to_numpy()
+    pair_names = pairs.to_numpy(dtype=np.int64)
+    # Each distinct tag string's names sit at starts[combo] for lens[combo].
+    lens = np.bincount(pair_combos, minlength=len(combos) + 1)
+    lens[-1] = 0  # For missing tags, which factorize codes as -1.
+    starts = np.cumsum(lens) - lens
+    first_year = int(counts["year"].min())
+    periods = (counts["year"].to_numpy() - first_year) * 4
+    periods += counts["quarter"].to_numpy() - 1
+    period_count = int(periods.max()) + 1
+    grid = np.zeros(len(names) * period_count, dtype=np.int64)
+    weights = counts["count"].to_numpy()
+    for begin in range(0, len(counts), chunk_rows):
+        end = begin + chunk_rows
+        combo_chunk = combo_codes[begin:end]
+        row_lens = lens[combo_chunk]
+        rows = np.repeat(np.arange(len(combo_chunk)), row_lens)
+        offsets = np.arange(len(rows)) - np.repeat(
+            np.cumsum(row_lens) - row_lens, row_lens
+        )
+        cells = pair_names[starts[combo_chunk][rows] + offsets] * period_count
+        cells += periods[begin:end][rows]
+        sums = np.bincount(cells, minlength=len(grid), weights=weights[begin:end][rows])
+        grid += sums.astype(np.int64)
+    cells = np.flatnonzero(grid)
+    name_codes, cell_periods = np.divmod(cells, period_count)
+    return pd.DataFrame(
+        {
+            "name": names[name_codes],
+            "year": first_year + cell_periods // 4,
+            "quarter": cell_periods % 4 + 1,
+            "count": grid[cells],
+        }
+    )
 
 
 def read_so_direct(counts: pd.DataFrame) -> pd.DataFrame:
@@ -74,25 +188,47 @@ def read_so_direct(counts: pd.DataFrame) -> pd.DataFrame:
 
 
 def run(args: Args):
-    keys = read_keys(args["keys"])
+    out = pth.Path(args["outdir"]) / "so-tags.json"
+    cache = partitions.PartitionCache(args["cache"]) if args["cache"] else None
     results: list[pd.DataFrame] = []
-    for so_name in args["so"]:
-        counts = read_so(so_name)
-        counts = map_tags(keys, counts)
+    if args["splice"] and out.exists():
+        # Previous output is oldest, so new inputs win where they overlap.
+        results.append(pd.read_json(out))
+    names = frames.expand(args["so"])
+    for counts in read_all(names, args=args, cache=cache):
         drop_obsolete(results, counts)
         # Treat each as authoritative for the ranges it covers.
         results.append(counts)
+    if cache:
+        print(f"cached: {cache.hits} / {cache.hits + cache.misses}")
+        metrics.count("partition_cache", hits=cache.hits, misses=cache.misses)
     results_all = pd.concat(results)
     results_all = results_all[["name", "year", "quarter", "count"]]
-    results_all = results_all.groupby(["name", "year", "quarter"]).sum()
+    results_all = results_all.groupby(["name", "year", "quarter"], observed=True).sum()
     results_all.reset_index(inplace=True)
     results_all.sort_values(by=["name", "year", "quarter"], inplace=True)
+    metrics.count("rows", len(results_all))
     results_all.to_json(
-        pth.Path(args["outdir"]) / "so-tags.json",
+        out,
         indent=2,
         orient="records",
     )
 
 
+def spans(name: str, *, parts: int) -> list[splits.Span | None]:
+    if so_dump.is_dump(name):
+        # Archives only stream from the start.
+        if pth.Path(name).suffix.lower() != ".xml":
+            return [None]
+    elif frames.format_of(name) != "csv":
+        return [None]
+    return splits.split_spans(name, parts=parts)
+
+
+def sum_counts(counts: pd.DataFrame) -> pd.DataFrame:
+    counts = counts.groupby(["name", "year", "quarter"], observed=True)["count"]
+    return counts.sum().reset_index()
+
+
 if __name__ == "__main__":
-    main()
+    metrics.run(main)
@@ -0,0 +1,54 @@
+import io
+import os
+import typing as typ
+
+Span = tuple[int, int]
+
+
+def iter_lines(name: str, span: Span) -> typ.Iterator[str]:
+    """Yields the decoded lines starting within the byte span."""
+    for line in iter_raw_lines(name, span):
+        yield line.decode()
+
+
+def iter_raw_lines(name: str, span: Span) -> typ.Iterator[bytes]:
+    start, end = span
+    with open(name, "rb") as input:
+        input.seek(start)
+        position = start
+        for line in input:
+            if position >= end:
+                break
+            position += len(line)
+            yield line
+
+
+def read_header(name: str) -> str:
+    with open(name, "rb") as input:
+        return input.readline().decode()
+
+
+def read_span(name: str, span: Span) -> io.StringIO:
+    """Gives the header line plus the span, ready for a csv reader."""
+    return io.StringIO(read_header(name) + "".join(iter_lines(name, span)))
+
+
+def split_spans(name: str, *, max_bytes: int = 1 << 28, parts: int) -> list[Span]:
+    """Splits a file past its header line into line-aligned byte spans.
+
+    Makes at least parts spans, or more to keep each under max_bytes.
+    Assumes no quoted newlines, which holds for our tag and event exports and
+    for the one row per line of data dump xml.
+    """
+    size = os.path.getsize(name)
+    with open(name, "rb") as input:
+        begin = len(input.readline())
+        count = max(1, parts, -(-(size - begin) // max_bytes))
+        bounds = [begin]
+        for index in range(1, count):
+            input.seek(max(bounds[-1], begin + (size - begin) * index // count))
+            # Finish the current line, so spans start on line boundaries.
+            input.readline()
+            bounds.append(input.tell())
+    bounds.append(size)
+    return [span for span in zip(bounds, bounds[1:]) if span[0] < span[1]]
@@ -0,0 +1,83 @@
+import gharchive
+import gzip
+import json
+import pandas as pd
+import pathlib as pth
+import pytest
+
+
+def event(type: str, repo: str, *, created_at: str = "2025-07-01T10:30:00Z") -> str:
+    record = {
+        "type": type,
+        "repo": {"name": repo, "url": f"https://api.github.com/repos/{repo}"},
+        "created_at": created_at,
+    }
+    return json.dumps(record) + "\n"
+
+
+def write_archives(dir: pth.Path) -> list[str]:
+    """Writes one whole hour and one cut short, as some real hours are."""
+    whole = [
+        *[event("WatchEvent", "owner/a")] * 3,
+        event("IssuesEvent", "owner/a"),
+        *[event("PushEvent", "owner/a")] * 2,
+        # Old archives say repository and give local times with offsets.
+        json.dumps(
+            {
+                "type": "WatchEvent",
+                "repository": {"url": "https://github.com/owner/b"},
+                "created_at": "2014-12-31T20:00:00-08:00",
+            }
+        )
+        + "\n",
+        '{"type": "WatchEvent", "repo": \n',
+    ]
+    whole_name = dir / "2025-07-01-10.json.gz"
+    whole_name.write_bytes(gzip.compress("".join(whole).encode()))
+    cut = [*[event("WatchEvent", "owner/a")] * 2]
+    cut += [event("PushEvent", f"owner/filler{index}") for index in range(200)]
+    cut_name = dir / "2025-07-01-11.json.gz"
+    cut_name.write_bytes(gzip.compress("".join(cut).encode())[:-100])
+    return [str(whole_name), str(cut_name)]
+
+
+def run_archive(dir: pth.Path, *, min_count: int, workers: int | None):
+    output = dir / "events.csv"
+    gharchive.run(
+        args={
+            "events": gharchive.default_events,
+            "inputs": write_archives(dir),
+            "min_count": min_count,
+            "output": str(output),
+            "partitions": 4,
+            "workers": workers,
+        }
+    )
+    return pd.read_csv(output)
+
+
+def test_read_archive_counts_and_notes_damage(tmp_path):
+    whole, cut = [
+        gharchive.read_archive(name, events=gharchive.default_events, partitions=1)
+        for name in write_archives(tmp_path)
+    ]
+    assert (whole.bad_lines, whole.kept, whole.lines) == (1, 5, 8)
+    assert not whole.truncated
+    assert cut.truncated
+    assert cut.kept == 2
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_run_sums_across_files(tmp_path, workers):
+    counts = run_archive(tmp_path, min_count=1, workers=workers)
+    assert list(counts.columns) == ["year", "quarter", "count", "event", "repo"]
+    assert counts.values.tolist() == [
+        [2015, 1, 1, "WatchEvent", "owner/b"],
+        [2025, 3, 5, "WatchEvent", "owner/a"],
+        [2025, 3, 1, "IssuesEvent", "owner/a"],
+    ]
+
+
+def test_run_drops_below_min_count(tmp_path):
+    counts = run_archive(tmp_path, min_count=2, workers=None)
+    assert counts[["count", "repo"]].values.tolist() == [[5, "owner/a"]]
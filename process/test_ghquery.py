@@ -0,0 +1,177 @@
+import ghmerge
+import ghquery
+import http.server
+import json
+import pathlib as pth
+import pytest
+import re
+import threading
+import time
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    server: "Server"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        found = re.findall(
+            r'(r\d+): repository\(owner: "([^"]*)", name: "([^"]*)"\)', body["query"]
+        )
+        names = [f"{owner}/{name}" for _, owner, name in found]
+        server = self.server
+        with server.lock:
+            server.queries.append(names)
+            rate_limited = server.rate_limited > 0
+            server.rate_limited -= 1
+        if server.status != 200:
+            self.send_response(server.status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        reset_at = time.time() + server.window
+        if rate_limited:
+            result = {
+                "data": None,
+                "errors": [
+                    {"message": "API rate limit exceeded", "type": "RATE_LIMITED"}
+                ],
+            }
+        elif server.poison & set(names):
+            result = {"data": None, "errors": [{"message": "Something went wrong"}]}
+        else:
+            data: dict = {
+                alias: {
+                    "isFork": False,
+                    "nameWithOwner": f"{owner}/{name}",
+                    "primaryLanguage": {"name": "Python"},
+                }
+                for alias, owner, name in found
+            }
+            reset_text = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(reset_at))
+            data["rateLimit"] = {
+                "cost": 1,
+                "remaining": server.remaining,
+                "resetAt": reset_text,
+            }
+            result = {"data": data}
+        content = json.dumps(result).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("x-ratelimit-remaining", "0" if rate_limited else "5000")
+        self.send_header("x-ratelimit-reset", str(int(reset_at)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(http.server.ThreadingHTTPServer):
+    """Stands in for the GraphQL endpoint, with behavior set per test."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.lock = threading.Lock()
+        self.poison: set[str] = set()
+        self.queries: list[list[str]] = []
+        self.rate_limited = 0
+        self.remaining = 5000
+        self.status = 200
+        self.window = 3600.0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/graphql"
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setenv("GITHUB_TOKEN", "test")
+    server = Server()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch) -> list[float]:
+    """Records sleeps instead of taking them, so pacing shows without waiting."""
+    sleeps: list[float] = []
+    monkeypatch.setattr(ghquery.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def run_args(tmp_path: pth.Path, *, repos: int, server: Server) -> ghquery.Args:
+    events = tmp_path / "events.csv"
+    rows = [
+        f"2025,3,{100 - index},WatchEvent,owner/repo{index}" for index in range(repos)
+    ]
+    events.write_text("\n".join(["year,quarter,count,event,repo", *rows]) + "\n")
+    return {
+        "batch_rows": 1_000_000,
+        "batch_size": 8,
+        "cache": None,
+        "cache_ttl": None,
+        "dones": None,
+        "endpoint": server.url,
+        "events": [str(events)],
+        "format": "segments",
+        "min_count": None,
+        "offline": False,
+        "outdir": str(tmp_path / "out"),
+        "retries": 1,
+        "sketch_width": None,
+        "target_seconds": 10.0,
+        "workers": 2,
+    }
+
+
+def test_pacer_spreads_remaining_over_window(server, sleeps):
+    # Ten requests to spare over the next 100 seconds.
+    server.remaining = ghquery.Pacer().reserve + 10
+    server.window = 100.0
+    client = ghquery.init_client()
+    pacer = ghquery.Pacer()
+    for _ in range(4):
+        ghquery.fetch(client, "query {}", endpoint=server.url, pacer=pacer, retries=0)
+    # Time never passes here, so each wait lines up after the one before.
+    assert sleeps == [pytest.approx(10, abs=0.5), pytest.approx(20, abs=0.5)]
+
+
+def test_rate_limited_waits_for_reset_without_a_try(server, sleeps):
+    server.rate_limited = 1
+    server.window = 30.0
+    client = ghquery.init_client()
+    result, _ = ghquery.fetch(
+        client, "query {}", endpoint=server.url, pacer=ghquery.Pacer(), retries=0
+    )
+    assert result["data"] is not None
+    assert len(server.queries) == 2
+    assert sleeps == [pytest.approx(31, abs=1)]
+
+
+def test_run_bisects_to_poison(server, sleeps, tmp_path):
+    server.poison = {"owner/repo5"}
+    args = run_args(tmp_path, repos=20, server=server)
+    ghquery.run(args=args)
+    index = ghmerge.load_index(args["outdir"])
+    try:
+        assert "owner/repo5" not in index
+        assert all(f"owner/repo{n}" in index for n in range(20) if n != 5)
+    finally:
+        index.close()
+    # Splits narrow down to the poison repo alone.
+    assert ["owner/repo5"] in server.queries
+
+
+def test_run_stops_on_outage_without_splitting(server, sleeps, tmp_path):
+    server.status = 503
+    args = run_args(tmp_path, repos=40, server=server)
+    with pytest.raises(ghquery.Unavailable):
+        ghquery.run(args=args)
+    assert {len(names) for names in server.queries} == {args["batch_size"]}
+    # Only what was in flight, each with its retry, and nothing more after.
+    assert len(server.queries) <= 2 * 2 * args["workers"]
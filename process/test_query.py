@@ -0,0 +1,69 @@
+import json
+import pathlib as pth
+import pytest
+import query
+import typing as typ
+
+
+class Pages:
+    """Stands in for a RowIterator, maybe dropping the connection partway."""
+
+    def __init__(
+        self, rows: list[dict], *, fail_at: int | None = None, page_size: int = 3
+    ):
+        self.fail_at = fail_at
+        self.page_size = page_size
+        self.rows = rows
+
+    @property
+    def pages(self) -> typ.Iterator[list[dict]]:
+        for number, start in enumerate(range(0, len(self.rows), self.page_size)):
+            if number == self.fail_at:
+                raise ConnectionError("connection lost")
+            yield self.rows[start : start + self.page_size]
+
+    def to_arrow_iterable(self) -> typ.Iterable[typ.Any]:
+        raise NotImplementedError
+
+
+rows = [
+    {"count": 100 - index, "tags": f"<tag{index}>", "year": 2020, "quarter": 1}
+    for index in range(10)
+]
+
+
+def export(pages: Pages, output: pth.Path, state: query.ExportState):
+    state_path = output.with_name(f"{output.name}.export.json")
+    query.export_csv(pages, output=output, state=state, state_path=state_path)
+
+
+def new_state() -> query.ExportState:
+    return {"bytes": 0, "rows": 0, "table": "project.dataset.table"}
+
+
+def test_export_csv_writes_header_and_state(tmp_path):
+    output = tmp_path / "so.csv"
+    state = new_state()
+    export(Pages(rows), output, state)
+    lines = output.read_text().splitlines()
+    assert lines[0] == "count,tags,year,quarter"
+    assert lines[1:] == [f"{100 - n},<tag{n}>,2020,1" for n in range(10)]
+    assert state == {**new_state(), "bytes": output.stat().st_size, "rows": 10}
+
+
+def test_export_csv_resumes_after_last_saved_page(tmp_path):
+    whole = tmp_path / "whole.csv"
+    export(Pages(rows), whole, new_state())
+    output = tmp_path / "so.csv"
+    with pytest.raises(ConnectionError):
+        export(Pages(rows, fail_at=2), output, new_state())
+    # As if a page got partly written before the saved state caught up.
+    with open(output, "a") as out_stream:
+        out_stream.write("7,<partial")
+    state_path = tmp_path / "so.csv.export.json"
+    state = json.loads(state_path.read_text())
+    assert state["rows"] == 6
+    # Resuming lists rows from the saved count, as run does with start_index.
+    export(Pages(rows[state["rows"] :]), output, state)
+    assert output.read_bytes() == whole.read_bytes()
+    assert state["rows"] == len(rows)
@@ -1,66 +1,180 @@
 import argparse
+import concurrent.futures as cf
+import datetime as dt
+import httpcache
+import json
+import metrics
+import net
 import pandas as pd
 import pathlib as pth
-import time
+import requests
 import typing as typ
 import urllib.parse
-import requests
 
 
 class Args(typ.Protocol):
+    cache: str | None
+    cache_ttl: float | None
+    end: str | None
     keys: str
+    offline: bool
     output: str
+    rate: float
+    workers: int
+
+
+class Fetcher:
+    """Shares one pooled session and rate limit across worker threads."""
+
+    def __init__(
+        self,
+        *,
+        cache: httpcache.ResponseCache | None = None,
+        end: str,
+        offline: bool = False,
+        rate: float,
+        workers: int,
+    ):
+        self.bucket = net.TokenBucket(rate=rate)
+        self.cache = cache
+        self.end = end
+        # Wikipedia also requires an easily reachable user agent.
+        headers = {"User-Agent": "https://tjpalmer.github.io/languish/"}
+        session = net.init_session(headers=headers, pool_size=workers)
+        if cache:
+            session = httpcache.CachedSession(session, cache=cache, offline=offline)
+        else:
+            assert not offline, "offline needs a cache"
+        self.session = session
+
+
+# Data starts in 2015, but asking from earlier is harmless.
+first_day = "20100101"
 
 
 def encode(key: str) -> str:
     return urllib.parse.quote(key, safe="")
 
 
-def handle_key(key: str, out_dir: pth.Path):
+def has_items(response: requests.Response) -> bool:
+    try:
+        return "items" in response.json()
+    except ValueError:
+        return False
+
+
+def handle_key(
+    key: str, out_dir: pth.Path, *, fetched: str | None, fetcher: Fetcher
+) -> tuple[pd.DataFrame | None, str | None]:
+    """Returns views for the key plus the last day now fetched through.
+
+    Only the months after what's already cached get requested.
+    """
     name = encode(key)
     out_path = out_dir / f"{name}.csv"
-    if out_path.exists():
-        views = pd.read_csv(out_path)
-    else:
-        # Supposed to limit to 200/s, so easy limit to below 100/s.
-        time.sleep(0.01)
-        views = query_views(key=key)
-        if views is not None:
-            views.to_csv(out_path, index=False)
-    return views
+    views = (
+        pd.read_csv(out_path, dtype={"timestamp": str}) if out_path.exists() else None
+    )
+    if views is not None and fetched is None and len(views):
+        # Caches from before we tracked fetches end at their last month.
+        fetched = month_end(views["timestamp"].max()[:8])
+    if fetched is not None and fetched >= fetcher.end:
+        return views, fetched
+    start = first_day if fetched is None else next_day(fetched)
+    tail = query_views(key=key, fetcher=fetcher, start=start)
+    if tail is None:
+        return views, fetched
+    if views is not None:
+        tail = pd.concat([views, tail]).drop_duplicates(subset="timestamp", keep="last")
+    tail.to_csv(out_path, index=False)
+    if not len(tail):
+        return tail, fetched
+    # Only through what came back, since the newest month can lag the end.
+    return tail, min(month_end(tail["timestamp"].max()[:8]), fetcher.end)
+
+
+def last_month_end(today: dt.date) -> str:
+    return (today.replace(day=1) - dt.timedelta(days=1)).strftime("%Y%m%d")
 
 
 def main():
     # Limit to 200/s
     # https://wikimedia.org/api/rest_v1/metrics/pageviews/per-article/en.wikipedia.org/all-access/user/C_Sharp_%28programming_language%29/monthly/20100101/20220331
     parser = argparse.ArgumentParser()
+    parser.add_argument("--cache", help="response cache file to share across runs")
+    parser.add_argument("--cache-ttl", help="max cached age in seconds", type=float)
+    parser.add_argument("--end", help="last day to fetch, as YYYYMMDD")
     parser.add_argument("--keys", required=True)
+    parser.add_argument("--offline", action="store_true", help="replay cache only")
     parser.add_argument("--output", required=True)
+    # Supposed to limit to 200/s, so easy limit to below that.
+    parser.add_argument("--rate", default=100, type=float)
+    parser.add_argument("--workers", default=16, type=int)
     run(parser.parse_args())
 
 
-def query_all(keys: pd.Series, out_dir: pth.Path):
+def month_end(day: str) -> str:
+    date = dt.datetime.strptime(day, "%Y%m%d").date()
+    next_month = (date.replace(day=28) + dt.timedelta(days=4)).replace(day=1)
+    return (next_month - dt.timedelta(days=1)).strftime("%Y%m%d")
+
+
+def next_day(day: str) -> str:
+    date = dt.datetime.strptime(day, "%Y%m%d").date() + dt.timedelta(days=1)
+    return date.strftime("%Y%m%d")
+
+
+def query_all(keys: pd.Series, out_dir: pth.Path, *, fetcher: Fetcher, workers: int):
+    # Track how far each key is fetched, so we never ask for history again.
+    fetched_path = out_dir / "fetched.json"
+    fetched: dict[str, str] = {}
+    if fetched_path.exists():
+        fetched = json.loads(fetched_path.read_text())
+    all_keys = [key for key_options in keys for key in key_options.split("|")]
+    with cf.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                handle_key, key, out_dir, fetched=fetched.get(key), fetcher=fetcher
+            )
+            for key in all_keys
+        ]
+        results = [future.result() for future in futures]
     all_views = []
-    for key_options in keys:
-        for key in key_options.split("|"):
-            views = handle_key(key=key, out_dir=out_dir)
-            all_views.append(views)
+    for key, (views, last) in zip(all_keys, results):
+        all_views.append(views)
+        if last is not None:
+            fetched[key] = last
+    fetched_path.write_text(json.dumps(fetched, indent=2, sort_keys=True))
     return pd.concat(all_views).reset_index(drop=True)
 
 
-def query_views(key: str) -> pd.DataFrame | None:
+def query_views(*, fetcher: Fetcher, key: str, start: str) -> pd.DataFrame | None:
     url = "/".join(
         [
             "https://wikimedia.org/api/rest_v1/metrics/pageviews/per-article",
             "en.wikipedia.org/all-access/user",
             encode(key),
-            "monthly/20100101/20220331",
+            f"monthly/{start}/{fetcher.end}",
         ]
     )
-    # Wikipedia also requires an easily reachable user agent.
-    headers = {"User-Agent": "https://tjpalmer.github.io/languish/"}
-    print(f"Querying: {key}")
-    data = requests.get(headers=headers, url=url).json()
+    print(f"Querying: {key} from {start}")
+    session = fetcher.session
+    if not (isinstance(session, httpcache.CachedSession) and session.has("GET", url)):
+        fetcher.bucket.take()
+    try:
+        options = {}
+        if isinstance(session, httpcache.CachedSession):
+            options["cacheable"] = has_items
+        response = session.get(url, timeout=30, **options)
+        metrics.observe("pageviews_seconds", response.elapsed.total_seconds())
+        data = response.json()
+    except (
+        httpcache.OfflineMiss,
+        requests.exceptions.RequestException,
+        ValueError,
+    ) as err:
+        print(f"{key}: {err}")
+        return None
     if "items" in data:
         return pd.DataFrame(data["items"])
     else:
@@ -73,9 +187,24 @@ def run(args: Args):
     keys = keys[~keys.isnull()]
     out_dir = pth.Path(args.output) / "wikipedia"
     out_dir.mkdir(exist_ok=True, parents=True)
-    views = query_all(keys=keys, out_dir=out_dir)
+    end = args.end or last_month_end(dt.date.today())
+    cache = None
+    if args.cache:
+        cache = httpcache.ResponseCache(args.cache, ttl=args.cache_ttl)
+    fetcher = Fetcher(
+        cache=cache,
+        end=end,
+        offline=args.offline,
+        rate=args.rate,
+        workers=args.workers,
+    )
+    views = query_all(keys=keys, out_dir=out_dir, fetcher=fetcher, workers=args.workers)
     print(views)
+    metrics.count("views", len(views))
+    if cache:
+        print(cache.report())
+        metrics.count("http_cache", **cache.stats())
 
 
 if __name__ == "__main__":
-    main()
+    metrics.run(main)
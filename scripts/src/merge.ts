@@ -8,24 +8,10 @@ let files = {
   soQuestions: "so-tags.json",
 };
 
-let canonicalNames = {
-  "AL Code": "AL",
-  BlitzBasic: "BlitzMax",
-  "Classic ASP": "ASP",
-  "Csound Document": "Csound",
-  "Csound Score": "Csound",
-  FORTRAN: "Fortran",
-  "Graphviz (DOT)": "DOT",
-  Matlab: "MATLAB",
-  Nimrod: "Nim",
-  PAWN: "Pawn",
-  Perl6: "Raku",
-  "Perl 6": "Raku",
-  REALbasic: "Xojo",
-  Sass: "Sass/SCSS",
-  SCSS: "Sass/SCSS",
-  VimL: "Vim script",
-} as { [name: string]: string };
+// Shared with process/assemble.py.
+let canonicalNames = JSON.parse(
+  readFileSync("./scripts/data/canonical-names.json").toString()
+) as { [name: string]: string };
 
 // TODO New script to calculate colors and find a seed to maximize the minimum
 // TODO distance between any top 10 (or 20?) languages.
@@ -33,52 +19,31 @@ let canonicalNames = {
 
 function main() {
   let dir = "./scripts/data";
-  let mergeKeys = ["name", "date"] as (keyof Count)[];
-  let items = [] as Count[];
+  let counts = {} as Counts;
   for (let key of Object.keys(files) as (keyof typeof files)[]) {
     let kidFull = join(dir, files[key]);
     let rawItems = JSON.parse(
       readFileSync(kidFull).toString()
     ) as CountString[];
-    let convertedItems = rawItems.map(
-      (item) =>
-        ({
-          name: canonicalNames[item.name] || item.name,
-          date: `${item.year}Q${item.quarter}`,
-          [key]: Number(item.count),
-        } as unknown as Count)
-    );
-    if (items.length) {
-      if (convertedItems.length) {
-        items = merge({ a: items, b: convertedItems, on: mergeKeys });
-      }
-    } else {
-      items = convertedItems;
-    }
+    counts[key] = rawItems.map((item) => ({
+      name: canonicalNames[item.name] || item.name,
+      time: 4 * Number(item.year) + Number(item.quarter) - 1,
+      count: Number(item.count),
+    }));
   }
-  // Convert to CSV-ish format and write.
-  // TODO Totals by quarter. Fraction for langs.
-  let sums = sumGrouped({
-    by: "date",
-    items,
-    outs: Object.keys(files) as (keyof typeof files)[],
-  });
-  let tabled = {
-    items: tablify(items),
-    sums: tablify(sums),
+  let bundled = {
+    ...encode(counts),
     // TODO Remove redundancies and auto-apply later?
     translations: readCsv("./scripts/data/keys.csv"),
   };
-  console.log(JSON.stringify(tabled));
+  console.log(JSON.stringify(bundled));
 }
 
 interface Count {
   name: string;
-  date: string;
-  issues: number;
-  pulls: number;
-  stars: number;
-  soQuestions: number;
+  // Quarters since year 0.
+  time: number;
+  count: number;
 }
 
 interface CountString {
@@ -88,99 +53,47 @@ interface CountString {
   count: string;
 }
 
-export interface MergeOptions<A, B> {
-  a: A[];
-  b: B[];
-  on: (keyof Partial<A | B>)[];
-}
+type Counts = { [key in keyof typeof files]: Count[] };
 
-export function merge<A extends {}, B extends {}>(
-  options: MergeOptions<A, B>
-): (A & B)[] {
-  // Extract data and prep compares.
-  let { a, b, on } = options;
-  if (!a.length || !b.length) return [];
-  let compares = on.map((key) => {
-    let value = a[0][key];
-    if (typeof value == "string") {
-      return (x: A | B, y: A | B) =>
-        (x[key] as unknown as string).localeCompare(
-          y[key] as unknown as string
-        );
-    } else {
-      return (x: A | B, y: A | B) =>
-        (x[key] as unknown as number) - (y[key] as unknown as number);
-    }
-  });
-  let compareKeys = (x: A | B, y: A | B) => {
-    if (!(x && y)) {
-      if (x) {
-        return -1;
-      } else if (y) {
-        return 1;
-      }
-      return 0;
+// Matches process/bundle.py, which writes the same bytes from the same counts.
+function encode(counts: Counts) {
+  let keys = Object.keys(counts) as (keyof Counts)[];
+  let all = ([] as Count[]).concat(...keys.map((key) => counts[key]));
+  let names = Array.from(new Set(all.map((count) => count.name))).sort();
+  let rows = new Map(names.map((name, row) => [name, row] as [string, number]));
+  // Reduce rather than spread, since there can be too many for arguments.
+  let first = all.reduce((min, count) => Math.min(min, count.time), Infinity);
+  let last = all.reduce((max, count) => Math.max(max, count.time), -Infinity);
+  if (!all.length) {
+    first = 0;
+    last = -1;
+  }
+  let quarters = last - first + 1;
+  let metrics = {} as { [key in keyof Counts]: string };
+  for (let key of keys) {
+    let grid = new Array(names.length * quarters).fill(0) as number[];
+    for (let count of counts[key]) {
+      // Renames can bring counts together, so sum them.
+      grid[rows.get(count.name)! * quarters + count.time - first] += count.count;
     }
-    for (let compare of compares) {
-      let result = compare(x, y);
-      if (result) {
-        return result;
+    let bytes = [] as number[];
+    for (let row = 0; row < names.length; row += 1) {
+      let previous = 0;
+      for (let column = 0; column < quarters; column += 1) {
+        let value = grid[row * quarters + column];
+        writeVarint(bytes, zigzag(value - previous));
+        previous = value;
       }
     }
-    return 0;
-  };
-  // Cat arrays and prep merge.
-  let combo = (a as (A | B)[]).concat(b).sort(compareKeys);
-  let keysA = new Set(Object.keys(a[0]));
-  let keysB = new Set(Object.keys(b[0]));
-  let extrasA = [...keysA].filter((key) => !keysB.has(key));
-  let extrasB = [...keysB].filter((key) => !keysA.has(key));
-  let extras = extrasA.concat(extrasB).sort() as (keyof (A | B))[];
-  let allKeys = on.concat(extras) as (keyof (A & B))[];
-  //~ console.error(combo.slice(0, 10));
-  //~ console.error(extras);
-  let build = (item: A | B) => {
-    let result = {} as A & B;
-    for (let key of allKeys) {
-      result[key] = item[key as keyof (A | B)] || (0 as any);
-    }
-    return result;
-  };
-  // Merge arrays.
-  let results = [] as (A & B)[];
-  let prev = build(combo[0]);
-  let equals = 0,
-    count = 0;
-  for (let item of combo.slice(1)) {
-    count += 1;
-    let comparison = compareKeys(prev, item);
-    if (comparison) {
-      // It's new, so just push it on.
-      results.push(prev);
-      prev = build(item);
-    } else {
-      // It was already there, so expand on it.
-      for (let key of extras) {
-        let value = (item as A & B)[key];
-        if (value != null) {
-          let prev_value = prev[key];
-          if (typeof prev_value == "number") {
-            // Increment existing numbers, because we end up with duplicates,
-            // because of different language names in the same quarter.
-            (prev[key] as unknown as number) =
-              prev_value + (value as unknown as number);
-          } else {
-            prev[key] = value;
-          }
-        }
-      }
-      equals += 1;
-    }
+    metrics[key] = Buffer.from(bytes).toString("base64");
   }
-  // Include the last one and done.
-  results.push(prev);
-  console.error(`${equals}/${count}`);
-  return results;
+  return {
+    metrics,
+    names,
+    quarters,
+    start: [Math.floor(first / 4), (first % 4) + 1],
+    version: 1,
+  };
 }
 
 function readCsv(name: string) {
@@ -199,73 +112,17 @@ function readCsv(name: string) {
   };
 }
 
-interface GroupOptions<
-  Item extends {},
-  By extends keyof Item,
-  Out extends keyof Item
-> {
-  items: Item[];
-  by: By;
-  outs: Out[];
-}
-
-// TODO Typing here is a disaster. See if there are ways to fix it all.
-function sumGrouped<
-  Item extends {},
-  By extends keyof Item,
-  Out extends keyof Item
->(options: GroupOptions<Item, By, Out>): { [Key in By | Out]: Item[Key] }[] {
-  let { items, by, outs } = options;
-  type Sums = { [Key in By | Out]: Item[Key] };
-  // Sum things up.
-  let keyedSums = {} as { [ByKey: string]: Sums };
-  for (let item of items) {
-    // TODO How to assert at type level that item[by] is string and
-    // TODO item[out] is number?
-    let key = item[by] as unknown as string;
-    let keyedSum = keyedSums[key];
-    if (!keyedSum) {
-      keyedSum = { [by]: key } as unknown as Sums;
-      for (let out of outs) {
-        keyedSum[out as keyof Sums] = 0 as any;
-      }
-      // console.error(key, keyedSum);
-      keyedSums[key] = keyedSum;
-    }
-    for (let out of outs) {
-      (keyedSum[out as keyof Sums] as unknown as number) +=
-        // Treat missing values as 0.
-        item[out] as unknown as number;
-    }
+function writeVarint(bytes: number[], value: number) {
+  // Arithmetic rather than bit ops, which would cut values to 32 bits.
+  while (value >= 0x80) {
+    bytes.push((value % 0x80) + 0x80);
+    value = Math.floor(value / 0x80);
   }
-  // Sort array of sums.
-  let sums = Object.keys(keyedSums)
-    .map((key) => keyedSums[key])
-    .sort((a, b) => {
-      return ((a as any)[by] as string).localeCompare((b as any)[by]);
-    });
-  // // Normalize.
-  // let normed = items.map(item => {
-  //   item = Object.assign({}, item);
-  //   let itemSums = keyedSums[item[by] as unknown as string];
-  //   for (let out of outs) {
-  //     (item[out] as unknown as number) /= itemSums[out] as unknown as number;
-  //   }
-  //   return item;
-  // });
-  // Done.
-  return sums;
-}
-
-interface Table<Item> {
-  keys: (keyof Item)[];
-  rows: Item[keyof Item][][];
+  bytes.push(value);
 }
 
-function tablify<Item extends {}>(items: Item[]): Table<Item> {
-  let keys = Object.keys(items[0]) as (keyof Item)[];
-  let rows = items.map((item) => keys.map((key) => item[key]));
-  return { keys, rows };
+function zigzag(value: number) {
+  return value < 0 ? -2 * value - 1 : 2 * value;
 }
 
 // Run main.
@@ -1,5 +1,5 @@
 // 1:1 port of index.ts from the non-preact version
-import tables from "data.json";
+import bundle from "data.json";
 import { murmur3 } from "murmurhash-js";
 
 export interface CoreMetrics {
@@ -44,6 +44,15 @@ type Keyed<Item> = {
   [key: string]: Item;
 };
 
+interface Bundle {
+  metrics: { [key in keyof CoreMetrics]: string };
+  names: string[];
+  quarters: number;
+  start: [number, number];
+  translations: Table<keyof Translation, Translation>;
+  version: number;
+}
+
 interface Data {
   colors: { [name: string]: string };
   dates: string[];
@@ -87,6 +96,47 @@ function keyOn<Key extends keyof Item, Item>(
   return result;
 }
 
+// Undoes the encoding from scripts/src/merge.ts or process/bundle.py.
+function decodeBundle(bundle: Bundle) {
+  let keys = Object.keys(bundle.metrics) as (keyof CoreMetrics)[];
+  let deltas = keys.map((key) => readVarints(bundle.metrics[key]));
+  let { names, quarters } = bundle;
+  let first = 4 * bundle.start[0] + bundle.start[1] - 1;
+  let dates = [] as string[];
+  for (let column = 0; column < quarters; column += 1) {
+    let time = first + column;
+    dates.push(`${Math.floor(time / 4)}Q${(time % 4) + 1}`);
+  }
+  let items = [] as Entry[];
+  let sums = {} as Keyed<DateMetrics>;
+  // Keep the name order from before bundles, since ranks keep it on ties.
+  let rows = names
+    .map((_, row) => row)
+    .sort((a, b) => names[a].localeCompare(names[b]));
+  for (let row of rows) {
+    let values = keys.map(() => 0);
+    for (let column = 0; column < quarters; column += 1) {
+      let cell = row * quarters + column;
+      keys.forEach((_, k) => {
+        values[k] += deltas[k][cell];
+      });
+      if (values.every((value) => !value)) {
+        // Nothing to list here, and fillDates puts back zeros as needed.
+        continue;
+      }
+      let date = dates[column];
+      let item = { name: names[row], date } as Entry;
+      let sum = sums[date] || (sums[date] = { date } as DateMetrics);
+      keys.forEach((key, k) => {
+        item[key] = values[k];
+        sum[key] = (sum[key] || 0) + values[k];
+      });
+      items.push(item);
+    }
+  }
+  return { items, sums: Object.values(sums) };
+}
+
 function fillDates({ dates, entries }: Data) {
   for (let [name, points] of Object.entries(entries)) {
     if (points.length !== dates.length) {
@@ -166,6 +216,27 @@ export function putMean({ entries, sums, weights }: MeanParams) {
   }
 }
 
+function readVarints(text: string): number[] {
+  let bytes = atob(text);
+  let values = [] as number[];
+  let value = 0;
+  let scale = 1;
+  for (let i = 0; i < bytes.length; i += 1) {
+    let byte = bytes.charCodeAt(i);
+    // Arithmetic rather than bit ops, which would cut values to 32 bits.
+    value += (byte & 0x7f) * scale;
+    if (byte & 0x80) {
+      scale *= 0x80;
+    } else {
+      // Zigzag keeps the sign in the low bit.
+      values.push(value % 2 ? -(value + 1) / 2 : value / 2);
+      value = 0;
+      scale = 1;
+    }
+  }
+  return values;
+}
+
 export function stringifyWeights(numbers: CoreMetrics): CoreMetricTexts {
   return Object.fromEntries(
     Object.entries(numbers).map(([key, value]) => [key, value.toString()])
@@ -220,16 +291,17 @@ function formatColor(color: Color) {
   return `hsl(${color.hue}, ${color.saturation}%, 70%)`;
 }
 
+let decoded = decodeBundle(bundle as any);
 let sums = keepFirst(
   keyOn({
     key: "date",
-    items: filterDate(tableToItems(tables.sums as any) as DateMetrics[]),
+    items: filterDate(decoded.sums),
   })
 );
 let dates = Object.keys(sums).sort();
 let entries = keyOn({
   key: "name",
-  items: filterDate(tableToItems(tables.items as any) as Entry[]),
+  items: filterDate(decoded.items),
 });
 let colors = Object.assign(
   {},
@@ -249,7 +321,7 @@ fillDates(data);
 let translations = keepFirst(
   keyOn({
     key: "key",
-    items: tableToItems(tables.translations as any) as Translation[],
+    items: tableToItems(bundle.translations as any) as Translation[],
   })
 );
 